@@ -1,2 +1,9 @@
 from layabauth.version import __version__
 from layabauth._openapi import authorizations, method_authorizations
+from layabauth._batch import validate_many
+from layabauth._circuit import CircuitBreaker
+from layabauth._http import KeysCache, openid_configuration
+from layabauth._instrumentation import Instrumentation
+from layabauth._shared import SharedKeys
+from layabauth._tokens import TokenCache
+from layabauth._verifier import Verifier, CryptographyVerifier, JoseVerifier
@@ -0,0 +1,92 @@
+import concurrent.futures
+import contextlib
+import itertools
+from typing import TYPE_CHECKING, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+from jose import exceptions
+
+from layabauth import _http
+
+if TYPE_CHECKING:  # httpx is only imported once keys are retrieved
+    import httpx
+
+
+def validate_many(
+    tokens: Iterable[str],
+    jwks_uri: Union[str, Mapping[str, str]],
+    *,
+    keys_cache: _http.KeysCache = None,
+    client: "httpx.Client" = None,
+    executor: concurrent.futures.Executor = None,
+    chunksize: int = 16,
+) -> List[Union[dict, exceptions.JOSEError]]:
+    """
+    Validate several tokens at once (such as tokens attached to queued messages).
+    Identical tokens are validated once. Tokens are grouped per JWKs URI and key identifier (kid),
+    so that keys are retrieved (or looked up in cache) once per group.
+
+    :param tokens: Tokens to validate.
+    :param jwks_uri: The JWKs URI (or OpenID Connect discovery URL), or the JWKs URI per issuer (as stated in the token iss claim).
+    :param keys_cache: layabauth.KeysCache instance used to store retrieved keys.
+    Default to a cache shared by every authentication mechanism, keeping keys for 5 minutes.
+    :param client: httpx.Client instance used to retrieve keys. Default to a client created (and closed) for this call.
+    :param executor: concurrent.futures.Executor instance (thread or process pool) used to validate tokens in parallel.
+    Default to None (tokens are validated within the calling thread).
+    :param chunksize: Number of tokens sent at once to each process of a process pool. Ignored by other executors.
+    :return: Per token (in the same order), the decoded token body,
+    or the jose.exceptions.JOSEError explaining why the token is invalid.
+    """
+    tokens = list(tokens)
+    results: Dict[str, Union[dict, exceptions.JOSEError]] = {}
+    groups: Dict[Tuple[str, Optional[str]], List[str]] = {}
+    for token in dict.fromkeys(tokens):
+        try:
+            uri = _http.jwks_uri_for(token, jwks_uri)
+        except exceptions.JOSEError as e:
+            results[token] = e
+            continue
+        groups.setdefault((uri, _http.key_identifier(token)), []).append(token)
+
+    with contextlib.ExitStack() as stack:
+        if client is None and groups:
+            import httpx
+
+            client = stack.enter_context(httpx.Client())
+
+        validating = []
+        for (uri, kid), group in groups.items():
+            try:
+                keys = _http.keys(client, uri, keys_cache, kid)
+            except exceptions.JOSEError as e:
+                results.update(dict.fromkeys(group, e))
+                continue
+
+            if executor is None:
+                results.update(
+                    zip(group, map(_validated, group, itertools.repeat(keys)))
+                )
+            else:
+                # Keys of the next group are retrieved while this group is validated
+                validating.append(
+                    (
+                        group,
+                        executor.map(
+                            _validated,
+                            group,
+                            itertools.repeat(keys),
+                            chunksize=chunksize,
+                        ),
+                    )
+                )
+
+        for group, validated in validating:
+            results.update(zip(group, validated))
+
+    return [results[token] for token in tokens]
+
+
+def _validated(token: str, keys: _http.KeySet) -> Union[dict, exceptions.JOSEError]:
+    try:
+        return _http.validate(token, keys)
+    except exceptions.JOSEError as e:
+        return e
@@ -0,0 +1,92 @@
+import contextlib
+import threading
+import time
+from typing import Dict, Optional
+
+from jose import exceptions
+
+
+class _Circuit:
+    def __init__(self):
+        # Number of consecutive failures
+        self.failures = 0
+        # Time at which retrieval was suspended, None if retrieval is allowed (closed)
+        self.opened_at: Optional[float] = None
+        # A retrieval is being attempted while suspended (half-open)
+        self.probing = False
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker around keys retrieval, per JWKs URI.
+    Once keys retrieval failed a number of consecutive times, retrieval is suspended (open circuit):
+    keys are not requested anymore and requests fail immediately (or use expired keys during the grace period),
+    instead of waiting for the identity provider to respond (or for the timeout to be reached).
+    Once suspended for long enough, a single retrieval is attempted (half-open circuit):
+    retrieval is allowed again if it succeeds, suspended again otherwise.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        :param failure_threshold: Number of consecutive failures suspending keys retrieval. Default to 5.
+        :param reset_timeout: Number of seconds during which keys retrieval is suspended,
+        before attempting a retrieval again. Default to 30 seconds.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits: Dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, jwks_uri: str) -> bool:
+        """
+        :return: True if keys retrieval is currently suspended (including while a retrieval is attempted).
+        """
+        with self._lock:
+            circuit = self._circuits.get(jwks_uri)
+            return circuit is not None and circuit.opened_at is not None
+
+    @contextlib.contextmanager
+    def guard(self, jwks_uri: str):
+        """
+        Context manager around a keys retrieval attempt, recording its outcome.
+
+        :raises jose.exceptions.JOSEError: if keys retrieval is suspended (retrieval should not be attempted).
+        """
+        self._acquire(jwks_uri)
+        try:
+            yield
+        except exceptions.JOSEError:
+            self._failed(jwks_uri)
+            raise
+        except BaseException:
+            # Retrieval was interrupted (cancelled), let another one be attempted
+            with self._lock:
+                self._circuits[jwks_uri].probing = False
+            raise
+        self._succeeded(jwks_uri)
+
+    def _acquire(self, jwks_uri: str):
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.setdefault(jwks_uri, _Circuit())
+            if circuit.opened_at is None:
+                return
+            if circuit.probing or circuit.opened_at + self.reset_timeout > now:
+                raise exceptions.JOSEError(
+                    f"Keys retrieval from {jwks_uri} is suspended after {circuit.failures} consecutive failures."
+                )
+            circuit.probing = True
+
+    def _failed(self, jwks_uri: str):
+        with self._lock:
+            circuit = self._circuits[jwks_uri]
+            circuit.failures += 1
+            circuit.probing = False
+            if circuit.opened_at is not None or (
+                circuit.failures >= self.failure_threshold
+            ):
+                circuit.opened_at = time.monotonic()
+
+    def _succeeded(self, jwks_uri: str):
+        with self._lock:
+            self._circuits[jwks_uri] = _Circuit()
@@ -1,7 +1,50 @@
-from typing import Mapping
+import concurrent.futures
+import contextlib
+import datetime
+import email.utils
+import json
+import logging
+import threading
+import time
+import urllib.parse
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
-import httpx
-from jose import jwt, exceptions
+from jose import exceptions
+
+from layabauth import _circuit, _instrumentation, _shared, _verifier
+
+if TYPE_CHECKING:
+    # Only imported once keys are retrieved (asyncio is already imported when running a coroutine)
+    import asyncio
+
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two background refreshes of the same keys
+_MIN_REFRESH_DELAY = 1
+# Number of seconds to wait before trying to refresh keys in background after a failure
+_RETRY_DELAY = 5
+# Number of seconds to wait before trying again to lock keys retrieval held by another process
+_SHARED_LOCK_DELAY = 0.05
+# Maximum number of keys received from another process remembered
+_MAX_KEY_SETS = 10
+# Maximum number of unknown key identifiers remembered per set of keys
+_MAX_UNKNOWN_KEY_IDENTIFIERS = 1000
+# Path of the OpenID Connect discovery document, relative to the issuer
+_CONFIGURATION_PATH = "/.well-known/openid-configuration"
 
 
 def _get_token(headers: Mapping[str, str]):
@@ -10,24 +53,943 @@ def _get_token(headers: Mapping[str, str]):
         return authorization[7:]
 
 
-def validate(token: str, key: str) -> dict:
-    return jwt.decode(
-        token=token, key=key, algorithms=["RS256"], options={"verify_aud": False}
+def _get_raw_token(headers: Iterable[Tuple[bytes, bytes]]):
+    """
+    Same as _get_token, but using ASGI headers (with lower-cased names).
+    """
+    for name, value in headers:
+        if name == b"authorization":
+            if value.startswith(b"Bearer "):
+                return value[7:].decode("latin-1")
+            return None
+
+
+def unverified_claims(token: Optional[str]) -> dict:
+    """
+    Token body, without verifying the token. Empty if there is no token or if token is invalid.
+    Meant for logging purposes only.
+    """
+    if not token:
+        return {}
+
+    from jose import jws
+
+    try:
+        claims = json.loads(jws.get_unverified_claims(token=token))
+    except (exceptions.JOSEError, ValueError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+def jwks_uri_for(token: str, jwks_uri: Union[str, Mapping[str, str]]) -> str:
+    """
+    JWKs URI providing the keys that were used to sign this token.
+
+    :param jwks_uri: The JWKs URI, or the JWKs URI per issuer (as stated in the unverified token iss claim).
+    :raises jose.exceptions.JOSEError: if the token cannot be decoded or if its issuer is not expected.
+    """
+    if isinstance(jwks_uri, str):
+        return jwks_uri
+    from jose import jwt
+
+    issuer = jwt.get_unverified_claims(token).get("iss")
+    try:
+        return jwks_uri[issuer]
+    except (KeyError, TypeError):
+        raise exceptions.JWTClaimsError("Invalid issuer")
+
+
+def jwks_uris(jwks_uri: Union[str, Mapping[str, str]]) -> List[str]:
+    """
+    Every JWKs URI (without duplicates).
+
+    :param jwks_uri: The JWKs URI, or the JWKs URI per issuer.
+    """
+    if isinstance(jwks_uri, str):
+        return [jwks_uri]
+    return list(dict.fromkeys(jwks_uri.values()))
+
+
+def openid_configuration(issuer: str) -> str:
+    """
+    OpenID Connect discovery URL of this issuer, to be provided instead of a JWKs URI.
+
+    :param issuer: The issuer, such as https://login.microsoftonline.com/common/v2.0
+    """
+    return issuer.rstrip("/") + _CONFIGURATION_PATH
+
+
+def is_configuration(uri: str) -> bool:
+    """
+    URI is an OpenID Connect discovery URL (providing the JWKs URI) instead of a JWKs URI.
+    Query parameters (such as Azure AD B2C policy) are allowed.
+    """
+    return urllib.parse.urlsplit(uri).path.endswith(_CONFIGURATION_PATH)
+
+
+def key_identifier(token: str) -> Optional[str]:
+    """
+    Key identifier (kid) as stated in the (unverified) token header.
+    None if not provided, if not a string or if token is invalid.
+    """
+    return _verifier._key_identifier(_verifier._unverified_header(token))
+
+
+def validate(token: str, keys: "KeySet") -> dict:
+    return keys.verifier.decode(token, keys)
+
+
+class KeySet:
+    """
+    JWKs (as received from the JWKs URI) indexed per key identifier (kid), keys without identifier are kept aside.
+    Keys are parsed and constructed (by the verifier) only once, on first use.
+    """
+
+    def __init__(self, text: str, verifier: _verifier.Verifier = None):
+        self.text = text
+        self.verifier = _verifier.default() if verifier is None else verifier
+        self._keys: Optional[Dict[str, Any]] = None
+        # Keys without identifier (kid is optional in a JWK), set before keys are parsed
+        self._without_kid: tuple = ()
+        # Key identifiers that were not found in those keys (even after a refresh)
+        self._unknown: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # Parsed keys cannot be pickled (to be validated in another process), only the keys as received
+        return _key_set, (self.text, self.verifier)
+
+    def has(self, kid: str) -> bool:
+        keys = self._keys if self._keys is not None else self._parse()
+        return kid in keys
+
+    def is_unknown(self, kid: str) -> bool:
+        return kid in self._unknown
+
+    def add_unknown(self, kid: str):
+        with self._lock:
+            # Do not grow without limit in case of random key identifiers
+            if len(self._unknown) >= _MAX_UNKNOWN_KEY_IDENTIFIERS:
+                self._unknown.clear()
+            self._unknown.add(kid)
+
+    def candidates(self, kid: Optional[str]) -> tuple:
+        """
+        Keys that can be used to verify a token signature.
+
+        :param kid: Key identifier as stated in the token header.
+        :return: The key with this identifier (keys without identifier if unknown). Every key if no identifier is provided.
+        """
+        keys = self._keys if self._keys is not None else self._parse()
+        if kid is None:
+            return tuple(keys.values()) + self._without_kid
+        key = keys.get(kid)
+        return (key,) if key else self._without_kid
+
+    def _parse(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._keys is None:
+                try:
+                    jwks = json.loads(self.text)["keys"]
+                except (ValueError, TypeError, KeyError) as e:
+                    raise exceptions.JOSEError(
+                        f"Invalid keys: {type(e).__name__} {str(e)}"
+                    ) from e
+
+                keys, without_kid = {}, []
+                for key in jwks:
+                    if key.get("use", "sig") != "sig":
+                        continue
+                    try:
+                        constructed = self.verifier.construct(key)
+                    except (exceptions.JOSEError, ValueError, TypeError, KeyError):
+                        # Ignore keys that cannot be used by the verifier
+                        continue
+                    if not isinstance(key.get("kid"), str):
+                        without_kid.append(constructed)
+                    else:
+                        keys[key["kid"]] = constructed
+                self._without_kid = tuple(without_kid)
+                self._keys = keys
+            return self._keys
+
+
+class Configuration:
+    """
+    OpenID Connect discovery document (as received from the discovery URL).
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        try:
+            self.jwks_uri = json.loads(text)["jwks_uri"]
+        except (ValueError, TypeError, KeyError) as e:
+            raise exceptions.JOSEError(
+                f"Invalid OpenID configuration: {type(e).__name__} {str(e)}"
+            ) from e
+        if not isinstance(self.jwks_uri, str):
+            raise exceptions.JOSEError("Invalid OpenID configuration: jwks_uri")
+
+
+def _request_keys(
+    client: "httpx.Client",
+    jwks_uri: str,
+    headers: dict,
+    instrumentation: _instrumentation.Instrumentation,
+) -> "httpx.Response":
+    import httpx
+
+    start = time.perf_counter()
+    try:
+        response = client.get(jwks_uri, headers=headers)
+    except httpx.HTTPError as e:
+        instrumentation.keys_retrieved(jwks_uri, time.perf_counter() - start, None)
+        raise _request_error(e)
+
+    instrumentation.keys_retrieved(
+        jwks_uri, time.perf_counter() - start, response.status_code
     )
+    return _checked(response)
+
 
+async def _async_request_keys(
+    client: "httpx.AsyncClient",
+    jwks_uri: str,
+    headers: dict,
+    instrumentation: _instrumentation.Instrumentation,
+) -> "httpx.Response":
+    import httpx
 
-# TODO Cache keys for faster token validation
-def keys(client: httpx.Client, jwks_uri: str) -> str:
+    start = time.perf_counter()
     try:
-        response = client.get(jwks_uri)
+        response = await client.get(jwks_uri, headers=headers)
     except httpx.HTTPError as e:
-        raise exceptions.JOSEError(
-            f"{type(e).__name__} error while retrieving keys: {str(e)}"
-        )
+        instrumentation.keys_retrieved(jwks_uri, time.perf_counter() - start, None)
+        raise _request_error(e)
 
+    instrumentation.keys_retrieved(
+        jwks_uri, time.perf_counter() - start, response.status_code
+    )
+    return _checked(response)
+
+
+def _request_error(e: "httpx.HTTPError") -> exceptions.JOSEError:
+    return exceptions.JOSEError(
+        f"{type(e).__name__} error while retrieving keys: {str(e)}"
+    )
+
+
+def _checked(response: "httpx.Response") -> "httpx.Response":
     if response.is_error:
         raise exceptions.JOSEError(
             f"HTTP {response.status_code} error while retrieving keys: {response.text}"
         )
 
-    return response.text
+    return response
+
+
+def _lifetime(response: "httpx.Response") -> Optional[float]:
+    """
+    Number of seconds during which the response can be considered as fresh.
+    As stated by HTTP caching headers (Cache-Control, Age and Expires), None if not provided.
+    0 if the response must be revalidated before being used again (no-cache, no-store).
+    """
+    directives = {}
+    for directive in response.headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.partition("=")
+        directives[name.strip().lower()] = value.strip().strip('"')
+
+    if "no-store" in directives or "no-cache" in directives:
+        return 0
+
+    if "max-age" in directives:
+        try:
+            max_age = int(directives["max-age"])
+            age = int(response.headers.get("Age", 0))
+        except ValueError:
+            return None
+        return max(max_age - age, 0)
+
+    if "Expires" in response.headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(response.headers["Expires"])
+            date = (
+                email.utils.parsedate_to_datetime(response.headers["Date"])
+                if "Date" in response.headers
+                else datetime.datetime.now(datetime.timezone.utc)
+            )
+            return max((expires - date).total_seconds(), 0)
+        except (TypeError, ValueError):
+            # Invalid dates (including 0) are considered as already expired
+            return 0
+
+    return None
+
+
+class _CachedKeys:
+    def __init__(
+        self,
+        keys: Union[KeySet, Configuration],
+        expiry: float,
+        etag: str,
+        last_modified: str,
+    ):
+        self.keys = keys
+        self.expiry = expiry
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+# Keys received from another process (per JWKs), so that they are parsed only once per process
+_key_sets: Dict[Tuple[str, _verifier.Verifier], KeySet] = {}
+
+
+def _key_set(text: str, verifier: _verifier.Verifier) -> KeySet:
+    keys = _key_sets.get((text, verifier))
+    if keys is None:
+        # Only keep the latest keys, they are expected to change rarely
+        if len(_key_sets) >= _MAX_KEY_SETS:
+            _key_sets.clear()
+        keys = _key_sets[(text, verifier)] = KeySet(text, verifier)
+    return keys
+
+
+class KeysCache:
+    """
+    Thread-safe cache of JWKs, per JWKs URI.
+    Keys are only retrieved again once expired, as stated by the HTTP caching headers of the JWKs URI response.
+    Refreshing keys is performed using a conditional request (If-None-Match, If-Modified-Since) when possible,
+    so that keys are kept as is if the server responds with HTTP 304 (Not Modified).
+    Only one request per JWKs URI is sent at a time, concurrent threads (or coroutines) wait for its result.
+    Keys are refreshed in case a token refers to an unknown key identifier (kid), at most once per minimum refresh interval.
+    Keys can be shared with other processes, so that they are retrieved by only one of them.
+    An OpenID Connect discovery URL can be provided instead of a JWKs URI,
+    the discovery document is then cached the same way, so that the JWKs URI is only retrieved once expired.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        min_ttl: float = 60,
+        grace_period: float = 0,
+        refresh_ahead: float = 30,
+        min_refresh_interval: float = 60,
+        verifier: _verifier.Verifier = None,
+        shared: _shared.SharedKeys = None,
+        instrumentation: _instrumentation.Instrumentation = None,
+        circuit_breaker: _circuit.CircuitBreaker = None,
+        timeout: Optional[float] = 10,
+    ):
+        """
+        :param ttl: Number of seconds during which retrieved keys are considered valid,
+        if the JWKs URI response does not provide any caching header (Cache-Control, Expires). Default to 5 minutes.
+        :param min_ttl: Minimum number of seconds during which retrieved keys are considered valid,
+        even if the JWKs URI response states a shorter lifetime (including no-cache, no-store, max-age=0 and Expires: 0).
+        Keys are then refreshed using a conditional request (if possible). Default to 1 minute.
+        :param grace_period: Number of seconds during which expired keys can still be used
+        while they are being refreshed, or if they cannot be refreshed. Default to 0 (expired keys are never used).
+        :param refresh_ahead: Number of seconds before expiry at which keys are refreshed,
+        when refreshed in background (see start_refreshing). Default to 30 seconds.
+        :param min_refresh_interval: Minimum number of seconds between two refreshes of non expired keys,
+        due to an unknown key identifier (kid). Default to 1 minute.
+        :param verifier: layabauth.Verifier instance used to construct keys and to verify tokens.
+        Default to layabauth.CryptographyVerifier if cryptography is installed, layabauth.JoseVerifier otherwise.
+        :param shared: layabauth.SharedKeys instance used to share keys with other processes on the same host.
+        Default to None (keys are not shared).
+        :param instrumentation: layabauth.Instrumentation instance receiving keys retrieval, keys cache
+        and token validation events (to report metrics). Default to None (events are ignored).
+        :param circuit_breaker: layabauth.CircuitBreaker instance suspending keys retrieval after consecutive failures.
+        Default to None (keys retrieval is always attempted).
+        :param timeout: Maximum number of seconds to wait for keys being retrieved by another thread or coroutine,
+        or for another process to release the shared keys lock (keys are then retrieved anyway).
+        Keys retrieval itself is bounded by the HTTP client timeout. Default to 10 seconds, None to wait indefinitely.
+        """
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.grace_period = grace_period
+        self.refresh_ahead = refresh_ahead
+        self.min_refresh_interval = min_refresh_interval
+        self.verifier = _verifier.default() if verifier is None else verifier
+        self.shared = shared
+        self.circuit_breaker = circuit_breaker
+        self.timeout = timeout
+        self.instrumentation = (
+            _instrumentation.Instrumentation()
+            if instrumentation is None
+            else instrumentation
+        )
+        self._keys: Dict[str, _CachedKeys] = {}
+        # Version of the shared keys last loaded or saved (per JWKs URI)
+        self._shared_versions: Dict[str, _shared.Version] = {}
+        # Last time keys were refreshed due to an unknown key identifier (per JWKs URI)
+        self._last_kid_refresh: Dict[str, float] = {}
+        # Keys being retrieved (per JWKs URI), so that concurrent requests wait for the same response
+        self._refreshing: Dict[str, concurrent.futures.Future] = {}
+        self._async_refreshing: Dict[
+            Tuple["asyncio.AbstractEventLoop", str], "asyncio.Future"
+        ] = {}
+        # Background refresh (per JWKs URI)
+        self._refreshers: Dict[str, Tuple[threading.Thread, threading.Event]] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, client: "httpx.Client", jwks_uri: str, kid: Optional[str] = None
+    ) -> KeySet:
+        """
+        :param jwks_uri: The JWKs URI, or the OpenID Connect discovery URL.
+        :param kid: Key identifier (kid) that should be part of the keys. Keys will be refreshed if it is not.
+        """
+        if is_configuration(jwks_uri):
+            jwks_uri = self._get(client, jwks_uri, force=False).jwks_uri
+        keys = self._get(client, jwks_uri, force=False)
+        if not self._refresh_for(keys, kid, jwks_uri, self._refreshing, jwks_uri):
+            return keys
+
+        try:
+            keys = self._get(client, jwks_uri, force=True)
+        except Exception:
+            # Token will be rejected with current keys
+            return keys
+        return self._check_known(keys, kid)
+
+    def refresh(self, client: "httpx.Client", jwks_uri: str) -> KeySet:
+        """
+        Retrieve keys (and OpenID Connect discovery document), even if not expired yet.
+        """
+        if is_configuration(jwks_uri):
+            jwks_uri = self._get(client, jwks_uri, force=True).jwks_uri
+        return self._get(client, jwks_uri, force=True)
+
+    async def async_get(
+        self, client: "httpx.AsyncClient", jwks_uri: str, kid: Optional[str] = None
+    ) -> KeySet:
+        """
+        :param jwks_uri: The JWKs URI, or the OpenID Connect discovery URL.
+        :param kid: Key identifier (kid) that should be part of the keys. Keys will be refreshed if it is not.
+        """
+        import asyncio
+
+        if is_configuration(jwks_uri):
+            jwks_uri = (await self._async_get(client, jwks_uri, force=False)).jwks_uri
+        keys = await self._async_get(client, jwks_uri, force=False)
+        if not self._refresh_for(
+            keys,
+            kid,
+            jwks_uri,
+            self._async_refreshing,
+            (asyncio.get_running_loop(), jwks_uri),
+        ):
+            return keys
+
+        try:
+            keys = await self._async_get(client, jwks_uri, force=True)
+        except Exception:
+            # Token will be rejected with current keys
+            return keys
+        return self._check_known(keys, kid)
+
+    def _refresh_for(
+        self,
+        keys: KeySet,
+        kid: Optional[str],
+        jwks_uri: str,
+        refreshing: dict,
+        refreshing_key,
+    ) -> bool:
+        """
+        Keys should be refreshed if the key identifier is unknown,
+        unless it is already known as unknown or if keys were refreshed for this reason not long ago.
+        """
+        if kid is None or keys.has(kid) or keys.is_unknown(kid):
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            # Wait for keys that are currently being retrieved
+            if refreshing_key in refreshing:
+                return True
+            last_refresh = self._last_kid_refresh.get(jwks_uri)
+            if (
+                last_refresh is not None
+                and last_refresh + self.min_refresh_interval > now
+            ):
+                return False
+            self._last_kid_refresh[jwks_uri] = now
+            return True
+
+    @staticmethod
+    def _check_known(keys: KeySet, kid: str) -> KeySet:
+        if not keys.has(kid):
+            keys.add_unknown(kid)
+        return keys
+
+    async def async_refresh(self, client: "httpx.AsyncClient", jwks_uri: str) -> KeySet:
+        """
+        Retrieve keys (and OpenID Connect discovery document), even if not expired yet.
+        """
+        if is_configuration(jwks_uri):
+            jwks_uri = (await self._async_get(client, jwks_uri, force=True)).jwks_uri
+        return await self._async_get(client, jwks_uri, force=True)
+
+    def _get(self, client: "httpx.Client", jwks_uri: str, force: bool) -> KeySet:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._keys.get(jwks_uri)
+            if cached and not force and cached.expiry > now:
+                self.instrumentation.keys_cache_hit(jwks_uri)
+                return cached.keys
+
+            refresh = self._refreshing.get(jwks_uri)
+            in_flight = refresh is not None
+            if in_flight and not force and self._usable(cached, now):
+                return self._stale(jwks_uri, cached, now)
+
+            if not in_flight:
+                refresh = self._refreshing[jwks_uri] = concurrent.futures.Future()
+
+        if not force:
+            self.instrumentation.keys_cache_miss(jwks_uri)
+
+        if in_flight:
+            # Keys are already being retrieved by another thread
+            try:
+                return refresh.result(self.timeout)
+            except concurrent.futures.TimeoutError:
+                raise self._timed_out(jwks_uri)
+
+        try:
+            # Keys are retrieved anyway if another process holds the lock for too long
+            with self._shared_lock(jwks_uri, blocking=True):
+                loaded = self._load_shared(jwks_uri, cached)
+                if loaded and loaded.expiry > time.monotonic():
+                    keys = loaded.keys
+                else:
+                    cached = loaded or cached
+                    with self._circuit(jwks_uri):
+                        response = _request_keys(
+                            client,
+                            jwks_uri,
+                            headers=cached.validators() if cached else {},
+                            instrumentation=self.instrumentation,
+                        )
+                    keys = self._store(jwks_uri, cached, response).keys
+        except BaseException as e:
+            refresh.set_exception(e)
+            if isinstance(e, Exception) and not force and self._usable(cached, now):
+                return self._stale(jwks_uri, cached, now)
+            raise
+        finally:
+            with self._lock:
+                del self._refreshing[jwks_uri]
+
+        refresh.set_result(keys)
+        return keys
+
+    async def _async_get(
+        self, client: "httpx.AsyncClient", jwks_uri: str, force: bool
+    ) -> KeySet:
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._keys.get(jwks_uri)
+            if cached and not force and cached.expiry > now:
+                self.instrumentation.keys_cache_hit(jwks_uri)
+                return cached.keys
+
+            refresh = self._async_refreshing.get((loop, jwks_uri))
+            in_flight = refresh is not None
+            if in_flight and not force and self._usable(cached, now):
+                return self._stale(jwks_uri, cached, now)
+
+            if not in_flight:
+                refresh = self._async_refreshing[(loop, jwks_uri)] = (
+                    loop.create_future()
+                )
+
+        if not force:
+            self.instrumentation.keys_cache_miss(jwks_uri)
+
+        if in_flight:
+            # Keys are already being retrieved by another coroutine
+            try:
+                keys = await asyncio.wait_for(asyncio.shield(refresh), self.timeout)
+            except asyncio.TimeoutError:
+                raise self._timed_out(jwks_uri)
+            if keys is None:
+                # Retrieval was cancelled with the coroutine retrieving keys, retrieve them instead
+                return await self._async_get(client, jwks_uri, force)
+            return keys
+
+        try:
+            # Do not block the event loop while another process retrieves keys
+            deadline = None if self.timeout is None else now + self.timeout
+            while True:
+                with self._shared_lock(jwks_uri, blocking=False) as locked:
+                    # Keys are retrieved anyway if another process holds the lock for too long
+                    if locked or (deadline is not None and time.monotonic() > deadline):
+                        loaded = self._load_shared(jwks_uri, cached)
+                        if loaded and loaded.expiry > time.monotonic():
+                            keys = loaded.keys
+                        else:
+                            cached = loaded or cached
+                            with self._circuit(jwks_uri):
+                                response = await _async_request_keys(
+                                    client,
+                                    jwks_uri,
+                                    headers=cached.validators() if cached else {},
+                                    instrumentation=self.instrumentation,
+                                )
+                            keys = self._store(jwks_uri, cached, response).keys
+                        break
+                await asyncio.sleep(_SHARED_LOCK_DELAY)
+        except asyncio.CancelledError:
+            # Do not cancel waiting coroutines, let them retrieve keys instead
+            refresh.set_result(None)
+            raise
+        except Exception as e:
+            refresh.set_exception(e)
+            # Flag the exception as retrieved, as there might be no other coroutine waiting for it
+            refresh.exception()
+            if not force and self._usable(cached, now):
+                return self._stale(jwks_uri, cached, now)
+            raise
+        finally:
+            with self._lock:
+                del self._async_refreshing[(loop, jwks_uri)]
+
+        refresh.set_result(keys)
+        return keys
+
+    def _timed_out(self, jwks_uri: str) -> exceptions.JOSEError:
+        return exceptions.JOSEError(
+            f"Keys retrieval from {jwks_uri} is still in progress after {self.timeout} seconds"
+        )
+
+    def _usable(self, cached: Optional[_CachedKeys], now: float) -> bool:
+        """
+        Expired keys can still be used during the grace period.
+        """
+        return cached is not None and cached.expiry + self.grace_period > now
+
+    def _stale(self, jwks_uri: str, cached: _CachedKeys, now: float) -> KeySet:
+        self.instrumentation.stale_keys_used(jwks_uri, max(now - cached.expiry, 0))
+        return cached.keys
+
+    def _circuit(self, jwks_uri: str):
+        if self.circuit_breaker is None:
+            return contextlib.nullcontext()
+        return self.circuit_breaker.guard(jwks_uri)
+
+    def _shared_lock(self, jwks_uri: str, blocking: bool):
+        if self.shared is None:
+            return contextlib.nullcontext(True)
+        return self.shared.lock(jwks_uri, blocking, self.timeout)
+
+    def load(self, jwks_uri: str) -> Optional[KeySet]:
+        """
+        Use keys saved by another process, or before a restart (see shared parameter), without retrieving them.
+        Meant to be called on startup, so that saved keys can be used while keys are being retrieved,
+        or if they cannot be retrieved (if not expired, or during the grace period).
+
+        :param jwks_uri: The JWKs URI, or the OpenID Connect discovery URL.
+        :return: Loaded keys. None if there is no usable saved keys, or if current keys are more recent.
+        """
+        if is_configuration(jwks_uri):
+            with self._lock:
+                cached = self._keys.get(jwks_uri)
+            configuration = self._load_shared(jwks_uri, cached) or cached
+            if not configuration:
+                return None
+            jwks_uri = configuration.keys.jwks_uri
+        with self._lock:
+            cached = self._keys.get(jwks_uri)
+        loaded = self._load_shared(jwks_uri, cached)
+        return loaded.keys if loaded else None
+
+    def _load_shared(
+        self, jwks_uri: str, cached: Optional[_CachedKeys]
+    ) -> Optional[_CachedKeys]:
+        """
+        Keys saved by another process (or before a restart), if they changed since last time,
+        if they are still usable (not expired, or during the grace period) and more recent than current keys.
+        """
+        if self.shared is None:
+            return None
+        version, entry = self.shared.load(jwks_uri, self._shared_versions.get(jwks_uri))
+        self._shared_versions[jwks_uri] = version
+        if entry is None:
+            return None
+        now = time.monotonic()
+        try:
+            loaded = _CachedKeys(
+                keys=self._document(jwks_uri, entry["keys"], _key_set),
+                expiry=now + entry["expires"] - time.time(),
+                etag=entry.get("etag"),
+                last_modified=entry.get("last_modified"),
+            )
+        except (KeyError, TypeError, exceptions.JOSEError):
+            return None
+        if not self._usable(loaded, now) or (cached and cached.expiry >= loaded.expiry):
+            return None
+        with self._lock:
+            self._keys[jwks_uri] = loaded
+        return loaded
+
+    def _store(
+        self,
+        jwks_uri: str,
+        cached: Optional[_CachedKeys],
+        response: "httpx.Response",
+    ) -> _CachedKeys:
+        lifetime = _lifetime(response)
+        # Do not retrieve keys for every request if the identity provider does not allow caching
+        lifetime = self.ttl if lifetime is None else max(lifetime, self.min_ttl)
+        expiry = time.monotonic() + lifetime
+        if cached and response.status_code == 304:
+            cached = _CachedKeys(
+                keys=cached.keys,
+                expiry=expiry,
+                etag=response.headers.get("ETag", cached.etag),
+                last_modified=response.headers.get(
+                    "Last-Modified", cached.last_modified
+                ),
+            )
+        else:
+            cached = _CachedKeys(
+                keys=self._document(jwks_uri, response.text, KeySet),
+                expiry=expiry,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+        with self._lock:
+            self._keys[jwks_uri] = cached
+        if self.shared:
+            self._shared_versions[jwks_uri] = self.shared.save(
+                jwks_uri,
+                {
+                    "keys": cached.keys.text,
+                    "expires": time.time() + lifetime,
+                    "etag": cached.etag,
+                    "last_modified": cached.last_modified,
+                },
+            )
+        return cached
+
+    def _document(
+        self, uri: str, text: str, key_set: Callable[..., KeySet]
+    ) -> Union[KeySet, Configuration]:
+        """
+        Keys (or OpenID Connect discovery document) as received from this URI.
+
+        :param key_set: Callable constructing keys out of the received text and the verifier.
+        :raises jose.exceptions.JOSEError: if the discovery document is invalid.
+        """
+        if is_configuration(uri):
+            return Configuration(text)
+        return key_set(text, self.verifier)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self._shared_versions.clear()
+            self._last_kid_refresh.clear()
+
+    def _refresh_delay(self, jwks_uri: str) -> float:
+        """
+        Number of seconds to wait before refreshing keys in background.
+        Keys are refreshed along with the OpenID Connect discovery document, when either of them is about to expire.
+        """
+        with self._lock:
+            cached = self._keys.get(jwks_uri)
+            configuration = None
+            if cached and is_configuration(jwks_uri):
+                configuration, cached = cached, self._keys.get(cached.keys.jwks_uri)
+        if not cached:
+            return 0
+        expiry = (
+            min(configuration.expiry, cached.expiry) if configuration else cached.expiry
+        )
+        return max(expiry - self.refresh_ahead - time.monotonic(), _MIN_REFRESH_DELAY)
+
+    def start_refreshing(self, clients: "Clients", jwks_uri: str):
+        """
+        Refresh keys in a background (daemon) thread, before they expire.
+        Does nothing if keys are already refreshed in background.
+        """
+        with self._lock:
+            refresher = self._refreshers.get(jwks_uri)
+            # A thread does not survive a fork
+            if refresher and refresher[0].is_alive():
+                return
+
+            stop = threading.Event()
+            thread = threading.Thread(
+                target=self._refresh_periodically,
+                args=(clients, jwks_uri, stop),
+                name=f"layabauth keys refresh ({jwks_uri})",
+                daemon=True,
+            )
+            self._refreshers[jwks_uri] = thread, stop
+        thread.start()
+
+    def stop_refreshing(self):
+        """
+        Stop every background thread refreshing keys.
+        """
+        with self._lock:
+            refreshers, self._refreshers = self._refreshers, {}
+        for thread, stop in refreshers.values():
+            stop.set()
+            thread.join()
+
+    def _refresh_periodically(
+        self, clients: "Clients", jwks_uri: str, stop: threading.Event
+    ):
+        delay = self._refresh_delay(jwks_uri)
+        while not stop.wait(delay):
+            try:
+                self.refresh(clients.sync(), jwks_uri)
+                delay = self._refresh_delay(jwks_uri)
+            except Exception:
+                logger.exception(f"Unable to refresh keys from {jwks_uri}.")
+                delay = _RETRY_DELAY
+
+    async def refresh_periodically(self, clients: "Clients", jwks_uri: str):
+        """
+        Refresh keys before they expire, until cancelled.
+        Meant to be run as an asyncio task.
+        """
+        import asyncio
+
+        delay = self._refresh_delay(jwks_uri)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.async_refresh(clients.asynchronous(), jwks_uri)
+                delay = self._refresh_delay(jwks_uri)
+            except Exception:
+                logger.exception(f"Unable to refresh keys from {jwks_uri}.")
+                delay = _RETRY_DELAY
+
+
+class Clients:
+    """
+    HTTP clients (synchronous and asynchronous) used to retrieve keys.
+    Each client is created on first use and then reused (keeping connections alive).
+    As connections cannot be shared between event loops, an asynchronous client is created per event loop.
+    """
+
+    def __init__(self, **httpx_kwargs):
+        """
+        :param httpx_kwargs: Any argument will be provided to httpx.Client (or httpx.AsyncClient).
+        """
+        self.httpx_kwargs = httpx_kwargs
+        self._sync: Optional["httpx.Client"] = None
+        self._async: Dict["asyncio.AbstractEventLoop", "httpx.AsyncClient"] = {}
+        self._lock = threading.Lock()
+
+    def sync(self) -> "httpx.Client":
+        if self._sync is None:
+            with self._lock:
+                if self._sync is None:
+                    import httpx
+
+                    self._sync = httpx.Client(**self.httpx_kwargs)
+        return self._sync
+
+    def asynchronous(self) -> "httpx.AsyncClient":
+        """
+        Client of the running event loop.
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        client = self._async.get(loop)
+        if client is None:
+            with self._lock:
+                client = self._async.get(loop)
+                if client is None:
+                    import httpx
+
+                    # Clients of closed event loops cannot be used (nor closed) anymore
+                    self._async = {
+                        other_loop: other_client
+                        for other_loop, other_client in self._async.items()
+                        if not other_loop.is_closed()
+                    }
+                    client = self._async[loop] = httpx.AsyncClient(**self.httpx_kwargs)
+        return client
+
+    def close(self):
+        with self._lock:
+            client, self._sync = self._sync, None
+        if client is not None:
+            client.close()
+
+    async def aclose(self):
+        """
+        Close the synchronous client and the client of the running event loop.
+        Clients of other event loops are forgotten.
+        """
+        import asyncio
+
+        self.close()
+        with self._lock:
+            clients, self._async = self._async, {}
+        client = clients.get(asyncio.get_running_loop())
+        if client is not None:
+            await client.aclose()
+
+
+# Shared by every authentication mechanism that does not provide its own cache
+keys_cache = KeysCache()
+
+
+def keys(
+    client: "httpx.Client",
+    jwks_uri: str,
+    cache: KeysCache = None,
+    kid: Optional[str] = None,
+) -> KeySet:
+    return (keys_cache if cache is None else cache).get(client, jwks_uri, kid)
+
+
+async def async_keys(
+    client: "httpx.AsyncClient",
+    jwks_uri: str,
+    cache: KeysCache = None,
+    kid: Optional[str] = None,
+) -> KeySet:
+    return await (keys_cache if cache is None else cache).async_get(
+        client, jwks_uri, kid
+    )
+
+
+def warm_up(client: "httpx.Client", jwks_uri: str, cache: KeysCache = None) -> KeySet:
+    """
+    Retrieve keys (if not cached), then parse and index them, so that requests do not have to.
+    """
+    key_set = keys(client, jwks_uri, cache)
+    key_set._parse()
+    return key_set
+
+
+async def async_warm_up(
+    client: "httpx.AsyncClient", jwks_uri: str, cache: KeysCache = None
+) -> KeySet:
+    """
+    Retrieve keys (if not cached), then parse and index them, so that requests do not have to.
+    """
+    key_set = await async_keys(client, jwks_uri, cache)
+    key_set._parse()
+    return key_set
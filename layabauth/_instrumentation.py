@@ -0,0 +1,74 @@
+from typing import Optional
+
+from jose import exceptions
+
+
+class Instrumentation:
+    """
+    Receive authentication events, to report metrics (such as layabauth.prometheus.PrometheusInstrumentation).
+    Every method does nothing by default, override the ones you are interested in.
+    Methods are called on the authentication path (from any thread), they should be fast and must not raise.
+    """
+
+    def keys_retrieved(
+        self, jwks_uri: str, duration: float, status_code: Optional[int]
+    ):
+        """
+        Keys (or OpenID Connect discovery document) were requested.
+
+        :param duration: Number of seconds spent waiting for the response.
+        :param status_code: HTTP status code of the response. None if no response was received (network failure).
+        """
+
+    def keys_cache_hit(self, jwks_uri: str):
+        """
+        Non expired keys were found in cache.
+        """
+
+    def keys_cache_miss(self, jwks_uri: str):
+        """
+        Keys were not found in cache (or expired), and had to be retrieved (by this or another thread or process).
+        """
+
+    def stale_keys_used(self, jwks_uri: str, staleness: float):
+        """
+        Expired keys were used during the grace period, as keys were being refreshed or could not be refreshed.
+
+        :param staleness: Number of seconds since keys expired.
+        """
+
+    def token_validated(self, jwks_uri: str, duration: float):
+        """
+        Token signature and claims were verified.
+
+        :param duration: Number of seconds spent verifying the token (keys retrieval excluded).
+        """
+
+    def token_rejected(self, reason: str):
+        """
+        Token was considered as invalid.
+
+        :param reason: Category of the failure (see failure_reason): keys, malformed, signature, expired or claims.
+        """
+
+
+def failure_reason(error: exceptions.JOSEError) -> str:
+    """
+    Category of a token validation failure:
+        * keys: keys could not be retrieved (or were invalid).
+        * malformed: token could not be decoded.
+        * signature: token signature could not be verified.
+        * expired: token is expired.
+        * claims: token claims are invalid (including an unexpected issuer).
+    """
+    if isinstance(error, exceptions.ExpiredSignatureError):
+        return "expired"
+    if isinstance(error, exceptions.JWTClaimsError):
+        return "claims"
+    if isinstance(error, exceptions.JWTError):
+        return (
+            "signature"
+            if str(error) == "Signature verification failed."
+            else "malformed"
+        )
+    return "keys"
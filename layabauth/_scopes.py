@@ -0,0 +1,43 @@
+from typing import Iterable, Optional, Union
+
+
+def provided_scopes(scopes: Optional[Union[str, Iterable[str]]]) -> frozenset:
+    """
+    :param scopes: Scopes provided in the token, or a space-delimited str (as in the OAuth2 scope claim).
+    """
+    if isinstance(scopes, str):
+        return frozenset(scopes.split())
+    return frozenset(scopes or ())
+
+
+class ExpectedScopes:
+    """
+    Scopes expected in a token, compiled once so that checking a scope does not depend on the number of scopes.
+    """
+
+    def __init__(self, expected_scopes: Iterable[str], any_of: bool = False):
+        """
+        :param expected_scopes: Scopes expected in the token.
+        :param any_of: At least one of the expected scopes must be provided. Default to False (all must be provided).
+        """
+        # Order is kept to report missing scopes as listed
+        self.expected_scopes = tuple(expected_scopes)
+        self.any_of = any_of
+        self._expected_scopes = frozenset(self.expected_scopes)
+
+    def missing(self, provided_scopes: frozenset) -> Optional[str]:
+        """
+        :return: Description of the missing scopes, None if provided scopes are sufficient.
+        """
+        if self.any_of:
+            if not self._expected_scopes or not self._expected_scopes.isdisjoint(
+                provided_scopes
+            ):
+                return None
+            return f"One of the {', '.join(self.expected_scopes)} scopes must be provided in the token."
+
+        if self._expected_scopes <= provided_scopes:
+            return None
+        for expected_scope in self.expected_scopes:
+            if expected_scope not in provided_scopes:
+                return f"The {expected_scope} must be provided in the token."
@@ -0,0 +1,206 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # fcntl is not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Number of seconds between two attempts to acquire a lock held by another process (when waiting for a limited time)
+_LOCK_DELAY = 0.05
+
+# Version stamp of a shared keys file: inode, modification time and size
+Version = Tuple[int, int, int]
+
+
+class SharedKeys:
+    """
+    Keys shared between processes (such as workers of a pre-fork server) on the same host, one file per JWKs URI.
+    Files are replaced atomically and identified by a version stamp (inode, modification time, size),
+    so that a file is only read again once it changed.
+    Keys retrieval is serialized between processes thanks to a lock file (if fcntl is available),
+    so that keys are only retrieved by one process while other processes wait for them.
+    Files that are not owned by the current user, or that can be modified by other users, are ignored.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        :param directory: Directory containing shared keys files.
+        Default to a directory only accessible by the current user (created if needed),
+        within /dev/shm (shared memory) if available, within the temporary directory otherwise.
+        Keys are not shared (and a warning is logged) if this default directory is not only accessible by the current user.
+        """
+        self.directory = _private_directory() if directory is None else directory
+
+    def _path(self, jwks_uri: str, extension: str) -> str:
+        name = hashlib.sha256(jwks_uri.encode()).hexdigest()
+        return os.path.join(self.directory, f"layabauth-{name}.{extension}")
+
+    def load(
+        self, jwks_uri: str, version: Optional[Version] = None
+    ) -> Tuple[Optional[Version], Optional[dict]]:
+        """
+        :param version: Version of the keys already known by the caller.
+        :return: Version of the keys and keys as saved by another process.
+        Keys are None if there is none, if they cannot be read, or if they did not change since provided version.
+        """
+        if self.directory is None:
+            return version, None
+
+        path = self._path(jwks_uri, "json")
+        try:
+            with open(path, "rb") as file:
+                stat = os.fstat(file.fileno())
+                current_version = _version(stat)
+                if current_version == version:
+                    return version, None
+                if not _is_trusted(stat):
+                    logger.warning(f"Ignoring untrusted shared keys file {path}.")
+                    return current_version, None
+                entry = json.load(file)
+        except OSError:
+            return version, None
+        except ValueError:
+            return current_version, None
+
+        if not isinstance(entry, dict) or entry.get("jwks_uri") != jwks_uri:
+            return current_version, None
+        return current_version, entry
+
+    def save(self, jwks_uri: str, entry: dict) -> Optional[Version]:
+        """
+        Atomically replace keys shared for this JWKs URI. Failures are logged and otherwise ignored.
+
+        :param entry: keys (as received from the JWKs URI), expires (timestamp), etag and last_modified.
+        :return: Version of the saved keys. None if keys could not be saved.
+        """
+        if self.directory is None:
+            return None
+
+        try:
+            descriptor, temporary_path = tempfile.mkstemp(
+                dir=self.directory, prefix="layabauth-", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(descriptor, "w") as file:
+                    json.dump(dict(entry, jwks_uri=jwks_uri), file)
+                    file.flush()
+                    # Renaming a file does not change its version
+                    version = _version(os.fstat(file.fileno()))
+                os.replace(temporary_path, self._path(jwks_uri, "json"))
+            except BaseException:
+                os.remove(temporary_path)
+                raise
+        except OSError:
+            logger.exception(f"Unable to share keys from {jwks_uri}.")
+            return None
+
+        return version
+
+    @contextlib.contextmanager
+    def lock(
+        self, jwks_uri: str, blocking: bool = True, timeout: Optional[float] = None
+    ):
+        """
+        Prevent other processes from retrieving keys for this JWKs URI meanwhile.
+        Does not prevent anything if fcntl is not available, or if the lock file cannot be opened.
+
+        :param blocking: Wait for the lock if it is held by another process.
+        :param timeout: Maximum number of seconds to wait for the lock (when blocking). Default to None (no limit).
+        :return: A context manager providing False if the lock is held by another process
+        (when not blocking, or once timed out).
+        """
+        if fcntl is None or self.directory is None:
+            yield True
+            return
+
+        path = self._path(jwks_uri, "lock")
+        try:
+            file = os.fdopen(
+                os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600), "a"
+            )
+        except OSError:
+            logger.exception(f"Unable to lock keys retrieval from {jwks_uri}.")
+            yield True
+            return
+
+        if not _is_trusted(os.fstat(file.fileno())):
+            # Another user could hold the lock forever
+            file.close()
+            logger.warning(f"Ignoring untrusted shared keys lock file {path}.")
+            yield True
+            return
+
+        # Lock is released when the file is closed
+        with file:
+            yield _acquire(file, blocking, timeout)
+
+
+def _acquire(file, blocking: bool, timeout: Optional[float]) -> bool:
+    if blocking and timeout is None:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        return True
+
+    # fcntl cannot wait for a limited amount of time
+    deadline = time.monotonic() + (timeout if blocking else 0)
+    while True:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+        time.sleep(_LOCK_DELAY)
+
+
+def _uid() -> Optional[int]:
+    # Files ownership cannot be checked on Windows (temporary directory is private to the user)
+    return os.getuid() if hasattr(os, "getuid") else None
+
+
+def _is_trusted(stat: os.stat_result) -> bool:
+    """
+    File is owned by the current user and cannot be modified by other users.
+    """
+    uid = _uid()
+    return uid is None or (stat.st_uid == uid and not stat.st_mode & 0o022)
+
+
+def _private_directory() -> Optional[str]:
+    """
+    Directory only accessible by the current user. None if it cannot be created, or if another user could access it.
+    """
+    parent = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    uid = _uid()
+    directory = os.path.join(parent, "layabauth" if uid is None else f"layabauth-{uid}")
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        logger.exception(f"Unable to create shared keys directory {directory}.")
+        return None
+
+    # Directory could have been created by another user (or be a symbolic link to such a directory)
+    status = os.lstat(directory)
+    if not stat.S_ISDIR(status.st_mode) or (
+        uid is not None and (status.st_uid != uid or status.st_mode & 0o077)
+    ):
+        logger.warning(
+            f"Keys are not shared as {directory} is not a directory only accessible by the current user."
+        )
+        return None
+    return directory
+
+
+def _version(stat: os.stat_result) -> Version:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
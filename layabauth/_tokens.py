@@ -0,0 +1,70 @@
+import collections
+import hashlib
+import threading
+import time
+from typing import Optional
+
+
+class TokenCache:
+    """
+    Thread-safe, bounded (least recently used), cache of validated tokens bodies.
+    Tokens are identified by their digest, alongside the JWKs URI providing the keys they were validated with
+    (raw tokens are not stored). A cache can therefore be shared by endpoints expecting tokens from different issuers.
+    A token body is kept until the token expires (exp claim), or until the time to live is expired (if sooner).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        :param maxsize: Maximum number of tokens bodies to keep. Default to 1024.
+        :param ttl: Maximum number of seconds during which a token body is kept.
+        Default to None (until the token expires). Tokens without expiry are only cached if provided.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._bodies = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str, jwks_uri: str) -> Optional[dict]:
+        """
+        :param jwks_uri: The JWKs URI providing the keys the token must have been validated with.
+        :return: A copy of the decoded token body, None if the token is not cached (or expired).
+        """
+        digest = _digest(token, jwks_uri)
+        with self._lock:
+            cached = self._bodies.get(digest)
+            if cached is None:
+                return None
+            expiry, token_body = cached
+            if expiry <= time.time():
+                del self._bodies[digest]
+                return None
+            self._bodies.move_to_end(digest)
+        return dict(token_body)
+
+    def put(self, token: str, jwks_uri: str, token_body: dict):
+        """
+        :param jwks_uri: The JWKs URI providing the keys the token was validated with.
+        """
+        expiry = token_body.get("exp")
+        if not isinstance(expiry, (int, float)):
+            expiry = None
+        now = time.time()
+        if self.ttl is not None:
+            expiry = now + self.ttl if expiry is None else min(expiry, now + self.ttl)
+        if expiry is None or expiry <= now:
+            return
+
+        digest = _digest(token, jwks_uri)
+        with self._lock:
+            self._bodies[digest] = expiry, dict(token_body)
+            self._bodies.move_to_end(digest)
+            while len(self._bodies) > self.maxsize:
+                self._bodies.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+
+
+def _digest(token: str, jwks_uri: str) -> bytes:
+    return hashlib.sha256(f"{jwks_uri}\0{token}".encode()).digest()
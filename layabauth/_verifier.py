@@ -0,0 +1,284 @@
+import abc
+import base64
+import binascii
+import importlib.util
+import json
+import time
+from typing import Iterable, Optional
+
+from jose import exceptions
+
+# cryptography is an optional dependency, only imported once keys are constructed
+_cryptography = importlib.util.find_spec("cryptography") is not None
+
+
+class Verifier(abc.ABC):
+    """
+    Verify tokens signature and claims, using keys constructed by this verifier.
+    Invalid tokens are reported by raising jose.exceptions.JOSEError.
+
+    Parsed keys are cached per keys and verifier, so verifiers are compared by type and algorithms.
+    Subclasses with other settings must extend __eq__ and __hash__ accordingly.
+    """
+
+    def __init__(self, algorithms: Iterable[str] = ("RS256",)):
+        """
+        :param algorithms: Allowed signature algorithms. Default to RS256 only.
+        """
+        self.algorithms = tuple(algorithms)
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.algorithms == other.algorithms
+
+    def __hash__(self) -> int:
+        return hash((type(self), self.algorithms))
+
+    @abc.abstractmethod
+    def construct(self, key: dict):
+        """
+        Construct the key that will be provided to decode.
+        Raise an exception if the key cannot be used by this verifier.
+
+        :param key: JWK (as a dictionary).
+        """
+
+    @abc.abstractmethod
+    def decode(self, token: str, keys) -> dict:
+        """
+        Verify token signature and claims.
+
+        :param token: The encoded token.
+        :param keys: layabauth._http.KeySet containing keys constructed by this verifier.
+        :return: The decoded token body.
+        """
+
+
+class JoseVerifier(Verifier):
+    """
+    Verify tokens using python-jose.
+    """
+
+    def construct(self, key: dict):
+        from jose import jwk
+
+        return jwk.construct(key, key.get("alg", self.algorithms[0]))
+
+    def decode(self, token: str, keys) -> dict:
+        from jose import jwt
+
+        header = _unverified_header(token)
+        try:
+            return jwt.decode(
+                token=token,
+                # An invalid token will be rejected before any key is required
+                key=keys.candidates(_key_identifier(header)) if header else (),
+                algorithms=list(self.algorithms),
+                options={"verify_aud": False},
+            )
+        except TypeError:
+            # python-jose fails to convert time claims that are neither numbers nor strings (signature is verified)
+            claims = jwt.get_unverified_claims(token)
+            name = next(
+                name
+                for name in _TIME_CLAIMS
+                if not isinstance(claims.get(name, 0), (int, float, str))
+            )
+            raise exceptions.JWTClaimsError(_TIME_CLAIMS[name])
+
+
+def _key_identifier(header: Optional[dict]) -> Optional[str]:
+    """
+    Key identifier (kid) as stated in the token header. None if not provided or if not a string.
+    """
+    kid = header.get("kid") if header else None
+    return kid if isinstance(kid, str) else None
+
+
+def _unverified_header(token: str) -> Optional[dict]:
+    from jose import jwt
+
+    try:
+        return jwt.get_unverified_header(token)
+    except exceptions.JOSEError:
+        return None
+
+
+class CryptographyVerifier(Verifier):
+    """
+    Verify tokens using cryptography directly (RSA and EC keys).
+    Errors are reported the same way python-jose does.
+    """
+
+    def __init__(self, algorithms: Iterable[str] = ("RS256",)):
+        """
+        :param algorithms: Allowed signature algorithms (RS256, RS384, RS512, ES256, ES384 and ES512 are supported).
+        Default to RS256 only.
+        """
+        if not _cryptography:
+            raise ImportError(
+                "cryptography must be installed: python -m pip install layabauth[cryptography]"
+            )
+        super().__init__(algorithms)
+        unsupported = set(self.algorithms) - set(_HASHES)
+        if unsupported:
+            raise ValueError(
+                f"Unsupported algorithms: {', '.join(sorted(unsupported))}"
+            )
+
+    def construct(self, key: dict):
+        from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+        if key.get("kty") == "RSA":
+            return rsa.RSAPublicNumbers(
+                e=_to_int(key["e"]), n=_to_int(key["n"])
+            ).public_key()
+        if key.get("kty") == "EC":
+            return ec.EllipticCurvePublicNumbers(
+                x=_to_int(key["x"]),
+                y=_to_int(key["y"]),
+                curve=getattr(ec, _CURVES[key["crv"]])(),
+            ).public_key()
+        raise exceptions.JWKError(f"Unsupported key type: {key.get('kty')}")
+
+    def decode(self, token: str, keys) -> dict:
+        try:
+            signing_input, signature_segment = token.encode().rsplit(b".", 1)
+            header_segment, claims_segment = signing_input.split(b".", 1)
+            # Same as python-jose, header padding errors are segments errors
+            header = _base64url_decode(header_segment)
+        except ValueError:
+            raise exceptions.JWTError("Not enough segments")
+
+        header = _json_object(header, "header")
+        claims = _decode_segment(claims_segment, "payload")
+        signature = _decode_segment(signature_segment, "crypto")
+
+        algorithm = header.get("alg")
+        if not algorithm:
+            raise exceptions.JWTError("No algorithm was specified in the JWS header.")
+        if algorithm not in self.algorithms:
+            raise exceptions.JWTError("The specified alg value is not allowed")
+
+        if not any(
+            _verified(key, algorithm, signing_input, signature)
+            for key in keys.candidates(_key_identifier(header))
+        ):
+            raise exceptions.JWTError("Signature verification failed.")
+
+        claims = _json_object(claims, "payload")
+        _validate_claims(claims)
+        return claims
+
+
+# Names of cryptography hashes (per algorithm) and elliptic curves (per JWK crv)
+_HASHES = {
+    "RS256": "SHA256",
+    "RS384": "SHA384",
+    "RS512": "SHA512",
+    "ES256": "SHA256",
+    "ES384": "SHA384",
+    "ES512": "SHA512",
+}
+_CURVES = {"P-256": "SECP256R1", "P-384": "SECP384R1", "P-521": "SECP521R1"}
+
+# Errors raised by python-jose per time claim (in validation order) if not an integer
+_TIME_CLAIMS = {
+    "iat": "Issued At claim (iat) must be an integer.",
+    "nbf": "Not Before claim (nbf) must be an integer.",
+    "exp": "Expiration Time claim (exp) must be an integer.",
+}
+
+
+def _to_int(value: str) -> int:
+    return int.from_bytes(_base64url_decode(value.encode()), "big")
+
+
+def _base64url_decode(value: bytes) -> bytes:
+    return base64.urlsafe_b64decode(value + b"=" * (-len(value) % 4))
+
+
+def _decode_segment(segment: bytes, name: str) -> bytes:
+    try:
+        return _base64url_decode(segment)
+    except (TypeError, binascii.Error):
+        raise exceptions.JWTError(f"Invalid {name} padding")
+
+
+def _json_object(segment: bytes, name: str) -> dict:
+    try:
+        value = json.loads(segment)
+    except ValueError as e:
+        raise exceptions.JWTError(f"Invalid {name} string: {e}")
+    if not isinstance(value, dict):
+        raise exceptions.JWTError(f"Invalid {name} string: must be a json object")
+    return value
+
+
+def _verified(key, algorithm: str, signing_input: bytes, signature: bytes) -> bool:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa, utils
+
+    hash_algorithm = getattr(hashes, _HASHES[algorithm])()
+    try:
+        if algorithm.startswith("RS"):
+            if not isinstance(key, rsa.RSAPublicKey):
+                return False
+            key.verify(signature, signing_input, padding.PKCS1v15(), hash_algorithm)
+        else:
+            if not isinstance(key, ec.EllipticCurvePublicKey):
+                return False
+            # Signature is the concatenation of r and s (RFC 7518)
+            size = (key.curve.key_size + 7) // 8
+            if len(signature) != 2 * size:
+                return False
+            key.verify(
+                utils.encode_dss_signature(
+                    int.from_bytes(signature[:size], "big"),
+                    int.from_bytes(signature[size:], "big"),
+                ),
+                signing_input,
+                ec.ECDSA(hash_algorithm),
+            )
+    except InvalidSignature:
+        return False
+    return True
+
+
+def _validate_claims(claims: dict):
+    """
+    Validate claims as python-jose does (audience is not verified).
+    """
+    now = int(time.time())
+    if "iat" in claims:
+        _int_claim(claims, "iat")
+
+    if "nbf" in claims:
+        nbf = _int_claim(claims, "nbf")
+        if nbf > now:
+            raise exceptions.JWTClaimsError("The token is not yet valid (nbf)")
+
+    if "exp" in claims:
+        exp = _int_claim(claims, "exp")
+        if exp < now:
+            raise exceptions.ExpiredSignatureError("Signature has expired.")
+
+    if "sub" in claims and not isinstance(claims["sub"], str):
+        raise exceptions.JWTClaimsError("Subject must be a string.")
+
+    if "jti" in claims and not isinstance(claims["jti"], str):
+        raise exceptions.JWTClaimsError("JWT ID must be a string.")
+
+
+def _int_claim(claims: dict, name: str) -> int:
+    try:
+        return int(claims[name])
+    except (TypeError, ValueError):
+        raise exceptions.JWTClaimsError(_TIME_CLAIMS[name])
+
+
+def default() -> Verifier:
+    """
+    Verifier using cryptography directly if installed, python-jose otherwise.
+    """
+    return CryptographyVerifier() if _cryptography else JoseVerifier()
@@ -1,16 +1,30 @@
+import atexit
 import logging
 import functools
-import json
+import os
+import time
+from typing import Dict, Optional, Tuple, Union
 
 import flask
-import httpx
 import werkzeug
-from jose import exceptions, jws
+from jose import exceptions
 
-from layabauth import _http
+from layabauth import _http, _instrumentation, _scopes, _tokens
 
+logger = logging.getLogger(__name__)
 
-def requires_authentication(jwks_uri: str, **httpx_kwargs):
+# Keys used by requires_authentication decorators (per keys cache and JWKs URI), see warm_up
+_keys_to_warm_up: Dict[Tuple[int, str], Tuple[_http.KeysCache, str, dict]] = {}
+
+
+def requires_authentication(
+    jwks_uri: Union[str, Dict[str, str]],
+    *,
+    keys_cache: _http.KeysCache = None,
+    refresh_keys: bool = False,
+    token_cache: _tokens.TokenCache = None,
+    **httpx_kwargs,
+):
     """
     Ensure that a valid JWT is received before entering the annotated endpoint.
 
@@ -18,8 +32,54 @@ def requires_authentication(jwks_uri: str, **httpx_kwargs):
     For more information on JWK, refer to https://tools.ietf.org/html/rfc7517
         * Azure Active Directory: https://sts.windows.net/common/discovery/keys
         * Microsoft Identity Platform: https://sts.windows.net/common/discovery/keys
+    Or the OpenID Connect discovery URL (ending with /.well-known/openid-configuration),
+    see layabauth.openid_configuration to provide an issuer. The JWKs URI is then discovered (and cached).
+    Or the JWKs URI per issuer (as stated in the token iss claim), or the discovery URL per issuer, to accept tokens from several issuers.
+    :param keys_cache: layabauth.KeysCache instance used to store retrieved keys.
+    Default to a cache shared by every endpoint, keeping keys for 5 minutes.
+    Keys saved by another process (or before a restart) are loaded by this decorator, see layabauth.SharedKeys.
+    :param refresh_keys: Refresh keys in a background thread (started on first request) before they expire.
+    Default to False (keys are refreshed when required by a request).
+    :param token_cache: layabauth.TokenCache instance used to store validated tokens bodies.
+    Default to None (every token is validated).
     :param httpx_kwargs: Any other argument will be provided to httpx.Client to be able to retrieve the keys.
+    The client is created on first request and reused until the application exits.
+    """
+    if keys_cache is None:
+        keys_cache = _http.keys_cache
+    clients = _http.Clients(**httpx_kwargs)
+    atexit.register(clients.close)
+    return _requires_authentication(
+        jwks_uri,
+        keys_cache,
+        clients,
+        refresh_keys,
+        {uri: token_cache for uri in _http.jwks_uris(jwks_uri)},
+    )
+
+
+def _requires_authentication(
+    jwks_uri: Union[str, Dict[str, str]],
+    keys_cache: _http.KeysCache,
+    clients: _http.Clients,
+    refresh_keys: bool,
+    token_caches: Dict[str, Optional[_tokens.TokenCache]],
+):
+    """
+    :param token_caches: Validated tokens cache per JWKs URI.
     """
+    for uri in _http.jwks_uris(jwks_uri):
+        # Use keys saved by another process (or before a restart) while keys are not retrieved
+        keys_cache.load(uri)
+        _keys_to_warm_up.setdefault(
+            (id(keys_cache), uri), (keys_cache, uri, clients.httpx_kwargs)
+        )
+
+    # JWKs URIs for which keys are refreshed in background, so that the keys cache is not locked on every request
+    refreshed_uris = set()
+    if hasattr(os, "register_at_fork"):
+        # A thread does not survive a fork
+        os.register_at_fork(after_in_child=refreshed_uris.clear)
 
     def decorator(func):
         @functools.wraps(func)
@@ -28,10 +88,35 @@ def requires_authentication(jwks_uri: str, **httpx_kwargs):
                 flask.g.token = _http._get_token(flask.request.headers)
                 if not flask.g.token:
                     raise werkzeug.exceptions.Unauthorized()
-                with httpx.Client(**httpx_kwargs) as client:
-                    key = _http.keys(client, jwks_uri)
-                flask.g.token_body = _http.validate(flask.g.token, key)
+                uri = _http.jwks_uri_for(flask.g.token, jwks_uri)
+                if refresh_keys and uri not in refreshed_uris:
+                    keys_cache.start_refreshing(clients, uri)
+                    refreshed_uris.add(uri)
+                token_cache = token_caches[uri]
+                token_body = (
+                    token_cache.get(flask.g.token, uri)
+                    if token_cache is not None
+                    else None
+                )
+                if token_body is None:
+                    key = _http.keys(
+                        clients.sync(),
+                        uri,
+                        keys_cache,
+                        _http.key_identifier(flask.g.token),
+                    )
+                    start = time.perf_counter()
+                    token_body = _http.validate(flask.g.token, key)
+                    keys_cache.instrumentation.token_validated(
+                        uri, time.perf_counter() - start
+                    )
+                    if token_cache is not None:
+                        token_cache.put(flask.g.token, uri, token_body)
+                flask.g.token_body = token_body
             except exceptions.JOSEError as e:
+                keys_cache.instrumentation.token_rejected(
+                    _instrumentation.failure_reason(e)
+                )
                 raise werkzeug.exceptions.Unauthorized(description=str(e)) from e
             return func(*func_args, **func_kwargs)
 
@@ -40,6 +125,113 @@ def requires_authentication(jwks_uri: str, **httpx_kwargs):
     return decorator
 
 
+def warm_up(*, raise_on_error: bool = False):
+    """
+    Retrieve, parse and index keys used by every requires_authentication decorator, so that requests do not have to.
+    Meant to be called on application initialization (once endpoints are declared), before requests are received.
+    If the application is then forked (pre-fork server), keys are inherited by every worker process.
+
+    :param raise_on_error: Raise jose.exceptions.JOSEError if keys cannot be retrieved (to prevent application startup).
+    Default to False (failure is logged and keys will be retrieved on first request).
+    """
+    for keys_cache, jwks_uri, httpx_kwargs in list(_keys_to_warm_up.values()):
+        _warm_up(keys_cache, jwks_uri, httpx_kwargs, raise_on_error)
+
+
+def _warm_up(
+    keys_cache: _http.KeysCache, jwks_uri: str, httpx_kwargs: dict, raise_on_error: bool
+):
+    import httpx
+
+    # Do not keep connections alive, as they would be shared with forked processes
+    with httpx.Client(**httpx_kwargs) as client:
+        try:
+            _http.warm_up(client, jwks_uri, keys_cache)
+        except exceptions.JOSEError:
+            if raise_on_error:
+                raise
+            logger.exception(f"Unable to warm up keys from {jwks_uri}.")
+
+
+class LayabAuth:
+    """
+    Flask extension holding resources shared by every endpoint decorated with its requires_authentication:
+    a single HTTP client (keeping connections alive), a single keys cache and a validated tokens cache per JWKs URI.
+    """
+
+    def __init__(
+        self,
+        app: flask.Flask = None,
+        *,
+        keys_cache: _http.KeysCache = None,
+        refresh_keys: bool = False,
+        token_cache_maxsize: int = 1024,
+        token_cache_ttl: Optional[float] = None,
+        **httpx_kwargs,
+    ):
+        """
+        :param app: Flask application. Can also be provided afterwards thanks to init_app.
+        :param keys_cache: layabauth.KeysCache instance used to store retrieved keys.
+        Default to a cache shared by every endpoint, keeping keys for 5 minutes.
+        :param refresh_keys: Refresh keys in a background thread (started on first request) before they expire.
+        Default to False (keys are refreshed when required by a request).
+        :param token_cache_maxsize: Maximum number of validated tokens bodies to keep (per JWKs URI).
+        Default to 1024. 0 means that every token is validated.
+        :param token_cache_ttl: Maximum number of seconds during which a validated token body is kept.
+        Default to None (until the token expires).
+        :param httpx_kwargs: Any other argument will be provided to httpx.Client to be able to retrieve the keys.
+        The client is created on first request and reused until the application exits.
+        """
+        self.keys_cache = _http.keys_cache if keys_cache is None else keys_cache
+        self.refresh_keys = refresh_keys
+        self.token_cache_maxsize = token_cache_maxsize
+        self.token_cache_ttl = token_cache_ttl
+        self.clients = _http.Clients(**httpx_kwargs)
+        atexit.register(self.clients.close)
+        # Validated tokens cache (per JWKs URI), as a token validated using some keys is not valid for others
+        self.token_caches: Dict[str, Optional[_tokens.TokenCache]] = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask):
+        app.extensions["layabauth"] = self
+
+    def requires_authentication(self, jwks_uri: Union[str, Dict[str, str]]):
+        """
+        Ensure that a valid JWT is received before entering the annotated endpoint.
+
+        :param jwks_uri: The JWKs URI as defined in .well-known.
+        For more information on JWK, refer to https://tools.ietf.org/html/rfc7517
+        Or the OpenID Connect discovery URL (ending with /.well-known/openid-configuration),
+        see layabauth.openid_configuration to provide an issuer. The JWKs URI is then discovered (and cached).
+        Or the JWKs URI per issuer (as stated in the token iss claim), or the discovery URL per issuer, to accept tokens from several issuers.
+        """
+        for uri in _http.jwks_uris(jwks_uri):
+            if uri not in self.token_caches:
+                self.token_caches[uri] = (
+                    _tokens.TokenCache(self.token_cache_maxsize, self.token_cache_ttl)
+                    if self.token_cache_maxsize
+                    else None
+                )
+        return _requires_authentication(
+            jwks_uri,
+            self.keys_cache,
+            self.clients,
+            self.refresh_keys,
+            self.token_caches,
+        )
+
+    def warm_up(self, *, raise_on_error: bool = False):
+        """
+        Retrieve, parse and index keys used by every endpoint decorated with requires_authentication.
+        See layabauth.flask.warm_up.
+        """
+        for jwks_uri in list(self.token_caches):
+            _warm_up(
+                self.keys_cache, jwks_uri, self.clients.httpx_kwargs, raise_on_error
+            )
+
+
 def requires_scopes(scopes: callable, *expected_scopes: str):
     """
     Ensure that the token contains the required scopes.
@@ -48,30 +240,61 @@ def requires_scopes(scopes: callable, *expected_scopes: str):
     :param scopes: callable receiving the token and the decoded token body and returning the list of associated scopes str.
     :param expected_scopes: all expected scopes in the token.
     """
-    try:
-        scopes = scopes(token=flask.g.token, token_body=flask.g.token_body) or []
-    except:
-        scopes = []
-
-    for expected_scope in expected_scopes:
-        if expected_scope not in scopes:
-            raise werkzeug.exceptions.Forbidden(
-                description=f"The {expected_scope} must be provided in the token."
+    _check_scopes(scopes, _scopes.ExpectedScopes(expected_scopes))
+
+
+def scopes_checker(scopes: callable, *expected_scopes: str, any_of: bool = False):
+    """
+    Ensure that the token contains the required scopes before entering the annotated endpoint.
+    Raises werkzeug.exceptions.Forbidden otherwise.
+    Expected scopes are compiled once, and token scopes are computed once per request (per scopes callable).
+    Meant to be applied after (below) requires_authentication.
+
+    :param scopes: callable receiving the token and the decoded token body and returning the list of associated scopes str.
+    :param expected_scopes: expected scopes in the token.
+    :param any_of: At least one of the expected scopes must be provided in the token.
+    Default to False (all expected scopes must be provided).
+    """
+    expected = _scopes.ExpectedScopes(expected_scopes, any_of)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*func_args, **func_kwargs):
+            _check_scopes(scopes, expected)
+            return func(*func_args, **func_kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _check_scopes(scopes: callable, expected: _scopes.ExpectedScopes):
+    token_scopes = flask.g.setdefault("token_scopes", {})
+    provided_scopes = token_scopes.get(scopes)
+    if provided_scopes is None:
+        try:
+            provided_scopes = _scopes.provided_scopes(
+                scopes(token=flask.g.token, token_body=flask.g.token_body)
             )
+        except Exception:
+            provided_scopes = frozenset()
+        token_scopes[scopes] = provided_scopes
+
+    missing = expected.missing(provided_scopes)
+    if missing:
+        raise werkzeug.exceptions.Forbidden(description=missing)
 
 
 def _extract_token_body() -> dict:
     if getattr(flask.g, "token_body", None):
         return flask.g.token_body
 
-    token = _http._get_token(flask.request.headers)
-    if not token:
-        return {}
-
-    try:
-        return json.loads(jws.get_unverified_claims(token=token))
-    except exceptions.JOSEError:
-        return {}
+    # Extracted only once per request, as it is performed for every log record
+    if "unverified_token_body" not in flask.g:
+        flask.g.unverified_token_body = _http.unverified_claims(
+            _http._get_token(flask.request.headers)
+        )
+    return flask.g.unverified_token_body
 
 
 class UserIdFilter(logging.Filter):
@@ -0,0 +1,84 @@
+from typing import Optional
+
+import prometheus_client
+
+from layabauth import _instrumentation
+
+
+class PrometheusInstrumentation(_instrumentation.Instrumentation):
+    """
+    Report authentication metrics using prometheus_client:
+        * <namespace>_keys_retrieval_seconds histogram (per jwks_uri and status): keys (identity provider) latency.
+        * <namespace>_keys_cache_lookups_total counter (per jwks_uri and result: hit, miss or stale).
+        * <namespace>_stale_keys_seconds histogram (per jwks_uri): time since used keys expired.
+        * <namespace>_token_validation_seconds histogram (per jwks_uri): token verification (CPU) latency.
+        * <namespace>_token_rejections_total counter (per reason: keys, malformed, signature, expired or claims).
+    """
+
+    def __init__(
+        self,
+        registry: prometheus_client.CollectorRegistry = prometheus_client.REGISTRY,
+        namespace: str = "layabauth",
+    ):
+        """
+        :param registry: Registry of the metrics. Default to the prometheus_client default registry.
+        :param namespace: Prefix of the metrics names. Default to layabauth.
+        """
+        self.keys_retrieval = prometheus_client.Histogram(
+            "keys_retrieval_seconds",
+            "Time spent retrieving keys (or OpenID Connect discovery document).",
+            ["jwks_uri", "status"],
+            namespace=namespace,
+            registry=registry,
+        )
+        self.keys_cache_lookups = prometheus_client.Counter(
+            "keys_cache_lookups",
+            "Keys cache lookups.",
+            ["jwks_uri", "result"],
+            namespace=namespace,
+            registry=registry,
+        )
+        self.stale_keys = prometheus_client.Histogram(
+            "stale_keys_seconds",
+            "Time since expired keys (used during grace period) expired.",
+            ["jwks_uri"],
+            namespace=namespace,
+            registry=registry,
+        )
+        self.token_validation = prometheus_client.Histogram(
+            "token_validation_seconds",
+            "Time spent verifying tokens (keys retrieval excluded).",
+            ["jwks_uri"],
+            namespace=namespace,
+            registry=registry,
+        )
+        self.token_rejections = prometheus_client.Counter(
+            "token_rejections",
+            "Tokens considered as invalid.",
+            ["reason"],
+            namespace=namespace,
+            registry=registry,
+        )
+
+    def keys_retrieved(
+        self, jwks_uri: str, duration: float, status_code: Optional[int]
+    ):
+        self.keys_retrieval.labels(
+            jwks_uri, "error" if status_code is None else str(status_code)
+        ).observe(duration)
+
+    def keys_cache_hit(self, jwks_uri: str):
+        self.keys_cache_lookups.labels(jwks_uri, "hit").inc()
+
+    def keys_cache_miss(self, jwks_uri: str):
+        self.keys_cache_lookups.labels(jwks_uri, "miss").inc()
+
+    def stale_keys_used(self, jwks_uri: str, staleness: float):
+        self.keys_cache_lookups.labels(jwks_uri, "stale").inc()
+        self.stale_keys.labels(jwks_uri).observe(staleness)
+
+    def token_validated(self, jwks_uri: str, duration: float):
+        self.token_validation.labels(jwks_uri).observe(duration)
+
+    def token_rejected(self, reason: str):
+        self.token_rejections.labels(reason).inc()
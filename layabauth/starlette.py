@@ -1,16 +1,31 @@
-from typing import Optional, Tuple
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
-import httpx
 from starlette.authentication import (
     AuthenticationBackend,
     AuthCredentials,
     BaseUser,
     AuthenticationError,
+    UnauthenticatedUser,
 )
-from starlette.requests import Request
+from starlette.exceptions import HTTPException
+from starlette.middleware.authentication import AuthenticationMiddleware
+from starlette.requests import HTTPConnection, Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
 from jose import exceptions
 
-from layabauth import _http
+from layabauth import _http, _instrumentation, _scopes, _tokens
+
+logger = logging.getLogger(__name__)
+
+# Body of the token received with the request being processed (within the request context), see UserIdFilter
+_token_body = contextvars.ContextVar("layabauth_token_body", default=None)
 
 
 class OAuth2IdTokenBackend(AuthenticationBackend):
@@ -19,37 +34,266 @@ class OAuth2IdTokenBackend(AuthenticationBackend):
     """
 
     def __init__(
-        self, jwks_uri: str, create_user: callable, scopes: callable, **httpx_kwargs
+        self,
+        jwks_uri: Union[str, Dict[str, str]],
+        create_user: callable,
+        scopes: callable,
+        *,
+        keys_cache: _http.KeysCache = None,
+        refresh_keys: bool = False,
+        token_cache: _tokens.TokenCache = None,
+        executor: concurrent.futures.Executor = None,
+        **httpx_kwargs,
     ):
         """
         :param jwks_uri: The JWKs URI as defined in .well-known.
         For more information on JWK, refer to https://tools.ietf.org/html/rfc7517
             * Azure Active Directory: https://sts.windows.net/common/discovery/keys
             * Microsoft Identity Platform: https://sts.windows.net/common/discovery/keys
+        Or the OpenID Connect discovery URL (ending with /.well-known/openid-configuration),
+        see layabauth.openid_configuration to provide an issuer. The JWKs URI is then discovered (and cached).
+        Or the JWKs URI per issuer (as stated in the token iss claim), or the discovery URL per issuer, to accept tokens from several issuers.
         :param create_user: callable receiving the token and the decoded token body and returning a starlette.BaseUser instance.
         :param scopes: callable receiving the token and the decoded token body and returning the list of associated scopes str.
-        :param httpx_kwargs: Any other argument will be provided to httpx.Client to be able to retrieve the keys.
+        :param keys_cache: layabauth.KeysCache instance used to store retrieved keys.
+        Default to a cache shared by every backend, keeping keys for 5 minutes.
+        Keys saved by another process (or before a restart) are loaded by this constructor, see layabauth.SharedKeys.
+        :param refresh_keys: Refresh keys in a background task (started by start) before they expire.
+        Default to False (keys are refreshed when required by a request).
+        :param token_cache: layabauth.TokenCache instance used to store validated tokens bodies.
+        Default to None (every token is validated).
+        :param executor: concurrent.futures.Executor instance (thread or process pool) used to validate tokens.
+        Default to None (tokens are validated within the event loop).
+        Tokens bodies found in token_cache are not validated (executor is not used).
+        :param httpx_kwargs: Any other argument will be provided to httpx.AsyncClient to be able to retrieve the keys.
+        The client is created on first request and reused until close is called.
         """
         self.jwks_uri = jwks_uri
         self.create_user = create_user
         self.scopes = scopes
+        self.keys_cache = _http.keys_cache if keys_cache is None else keys_cache
+        self.refresh_keys = refresh_keys
+        self.token_cache = token_cache
+        self.executor = executor
         self.httpx_kwargs = httpx_kwargs
+        self._clients = _http.Clients(**httpx_kwargs)
+        self._refresh_tasks: List[asyncio.Task] = []
+        for uri in _http.jwks_uris(jwks_uri):
+            # Use keys saved by another process (or before a restart) while keys are not retrieved
+            self.keys_cache.load(uri)
+
+    async def warm_up(self, raise_on_error: bool = False):
+        """
+        Retrieve, parse and index keys, so that requests do not have to.
+
+        :param raise_on_error: Raise jose.exceptions.JOSEError if keys cannot be retrieved (to prevent application startup).
+        Default to False (failure is logged and keys will be retrieved on first request).
+        """
+        for uri in _http.jwks_uris(self.jwks_uri):
+            try:
+                await _http.async_warm_up(
+                    self._clients.asynchronous(), uri, self.keys_cache
+                )
+            except exceptions.JOSEError:
+                if raise_on_error:
+                    raise
+                logger.exception(f"Unable to warm up keys from {uri}.")
+
+    async def start(self):
+        """
+        Warm up keys (see warm_up) and start refreshing keys in background (if requested).
+        Meant to be called on application startup (Starlette on_startup).
+        """
+        await self.warm_up()
+        if self.refresh_keys and not self._refresh_tasks:
+            self._refresh_tasks = [
+                asyncio.ensure_future(
+                    self.keys_cache.refresh_periodically(self._clients, uri)
+                )
+                for uri in _http.jwks_uris(self.jwks_uri)
+            ]
+
+    async def close(self):
+        """
+        Stop refreshing keys in background and close the HTTP client used to retrieve keys.
+        Meant to be called on application shutdown (Starlette on_shutdown).
+        """
+        refresh_tasks, self._refresh_tasks = self._refresh_tasks, []
+        for refresh_task in refresh_tasks:
+            refresh_task.cancel()
+            try:
+                await refresh_task
+            except asyncio.CancelledError:
+                pass
+        await self._clients.aclose()
 
     async def authenticate(
         self, request: Request
     ) -> Optional[Tuple["AuthCredentials", "BaseUser"]]:
         token = _http._get_token(request.headers)
         if not token:
+            _token_body.set({})
             return  # Consider that user is not authenticated
 
+        return await self._authenticate(token)
+
+    async def _authenticate(self, token: str) -> Tuple["AuthCredentials", "BaseUser"]:
         try:
-            with httpx.Client(**self.httpx_kwargs) as client:
-                key = _http.keys(client, self.jwks_uri)
-            json_body = _http.validate(token, key)
+            json_body = await self._validate(token)
         except exceptions.JOSEError as e:
+            self.keys_cache.instrumentation.token_rejected(
+                _instrumentation.failure_reason(e)
+            )
+            _token_body.set(_http.unverified_claims(token))
             raise AuthenticationError(str(e)) from e
 
+        _token_body.set(json_body)
         return (
             AuthCredentials(scopes=self.scopes(token=token, token_body=json_body)),
             self.create_user(token=token, token_body=json_body),
         )
+
+    async def _validate(self, token: str) -> dict:
+        jwks_uri = _http.jwks_uri_for(token, self.jwks_uri)
+        if self.token_cache is not None:
+            json_body = self.token_cache.get(token, jwks_uri)
+            if json_body is not None:
+                return json_body
+
+        key = await _http.async_keys(
+            self._clients.asynchronous(),
+            jwks_uri,
+            self.keys_cache,
+            _http.key_identifier(token),
+        )
+        start = time.perf_counter()
+        if self.executor is None:
+            json_body = _http.validate(token, key)
+        else:
+            json_body = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _http.validate, token, key
+            )
+        self.keys_cache.instrumentation.token_validated(
+            jwks_uri, time.perf_counter() - start
+        )
+        if self.token_cache is not None:
+            self.token_cache.put(token, jwks_uri, json_body)
+        return json_body
+
+
+class OAuth2IdTokenMiddleware(AuthenticationMiddleware):
+    """
+    ASGI authentication middleware, to be used instead of starlette AuthenticationMiddleware with a
+    layabauth.starlette.OAuth2IdTokenBackend.
+    Token is extracted from the raw ASGI headers, without creating a connection (or request) instance,
+    unless authentication fails and on_error has to be called.
+    Authentication result is stored in scope["auth"] and scope["user"], as with starlette AuthenticationMiddleware.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend: OAuth2IdTokenBackend,
+        on_error: Callable[[HTTPConnection, AuthenticationError], Response] = None,
+    ):
+        """
+        :param backend: layabauth.starlette.OAuth2IdTokenBackend instance used to validate tokens.
+        :param on_error: callable receiving the connection and the authentication error and returning a response.
+        Default to a HTTP 400 (Bad Request) response containing the error message.
+        """
+        super().__init__(app, backend, on_error)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        token = _http._get_raw_token(scope["headers"])
+        if not token:
+            # Consider that user is not authenticated
+            scope["auth"], scope["user"] = AuthCredentials(), UnauthenticatedUser()
+            _token_body.set({})
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            scope["auth"], scope["user"] = await self.backend._authenticate(token)
+        except AuthenticationError as exc:
+            response = self.on_error(HTTPConnection(scope), exc)
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1000})
+            else:
+                await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+
+def scopes_checker(*expected_scopes: str, any_of: bool = False):
+    """
+    Ensure that the authenticated user has the required scopes (as provided by the authentication backend)
+    before entering the annotated endpoint (function or method receiving the request).
+    Raises starlette.exceptions.HTTPException (403 Forbidden) otherwise.
+    Expected scopes are compiled once, and provided scopes are indexed once per request.
+
+    :param expected_scopes: expected scopes.
+    :param any_of: At least one of the expected scopes must be provided.
+    Default to False (all expected scopes must be provided).
+    """
+    expected = _scopes.ExpectedScopes(expected_scopes, any_of)
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                _check_scopes(_connection(args, kwargs), expected)
+                return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            _check_scopes(_connection(args, kwargs), expected)
+            return func(*args, **kwargs)
+
+        return sync_wrapper
+
+    return decorator
+
+
+def _connection(args: tuple, kwargs: dict) -> HTTPConnection:
+    for arg in (*args, *kwargs.values()):
+        if isinstance(arg, HTTPConnection):
+            return arg
+    raise TypeError("Endpoint does not receive the request.")
+
+
+def _check_scopes(connection: HTTPConnection, expected: _scopes.ExpectedScopes):
+    provided_scopes = connection.scope.get("layabauth.scopes")
+    if provided_scopes is None:
+        provided_scopes = connection.scope["layabauth.scopes"] = frozenset(
+            connection.auth.scopes
+        )
+
+    missing = expected.missing(provided_scopes)
+    if missing:
+        raise HTTPException(status_code=403, detail=missing)
+
+
+class UserIdFilter(logging.Filter):
+    """
+    This is a logging filter that makes the user identifier available for use in the logging format.
+    User identifier is extracted from the token body of the request being processed
+    (as stored by layabauth.starlette.OAuth2IdTokenBackend within the request context), once per request.
+    Note that the token body is not verified if authentication failed.
+    """
+
+    def __init__(self, token_field_name: str, name: str = ""):
+        logging.Filter.__init__(self, name=name)
+        self.token_field_name = token_field_name
+
+    def filter(self, record):
+        token_body = _token_body.get()
+        record.user_id = token_body.get(self.token_field_name, "") if token_body else ""
+        return True
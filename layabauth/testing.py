@@ -5,14 +5,17 @@ import layabauth._http
 @pytest.fixture
 def auth_mock(monkeypatch, token_body: dict, jwks_uri: str):
     # Mock keys
-    def keys_mock(client, uri):
+    def keys_mock(client, uri, *args, **kwargs):
         assert (
             uri == jwks_uri
         ), f"The mocked JWKS URI does not match the one used by project: {jwks_uri} != {uri}"
+        return layabauth._http.KeySet('{"keys": []}')
+
+    async def async_keys_mock(client, uri, *args, **kwargs):
+        return keys_mock(client, uri)
 
     monkeypatch.setattr(layabauth._http, "keys", keys_mock)
+    monkeypatch.setattr(layabauth._http, "async_keys", async_keys_mock)
 
     # Mock token validation (TODO only deactivate validation so that clients can use raw tokens)
-    monkeypatch.setattr(
-        layabauth._http.jwt, "decode", lambda *args, **kwargs: token_body
-    )
+    monkeypatch.setattr(layabauth._http, "validate", lambda *args, **kwargs: token_body)
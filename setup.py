@@ -43,7 +43,15 @@ setup(
         "python-jose==3.*",
     ],
     extras_require={
+        # Used to verify tokens faster
+        "cryptography": ["cryptography"],
+        # Used to report metrics
+        "prometheus": ["prometheus_client"],
         "testing": [
+            # Used to test the default verifier
+            "cryptography",
+            # Used to test metrics reporting
+            "prometheus_client",
             # Used to test flask application
             "flask_restx==1.1.*",
             "pytest-flask==1.*",
@@ -54,7 +62,7 @@ setup(
             "pytest-httpx==0.22.*",
             # Used to check coverage
             "pytest-cov==3.*",
-        ]
+        ],
     },
     python_requires=">=3.7",
     project_urls={
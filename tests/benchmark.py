@@ -0,0 +1,357 @@
+"""
+Offline benchmarks of the authentication path, reporting operations per second and latency percentiles.
+
+Keys are served by a local JWKs stand-in (httpx.MockTransport), no network access is required.
+Caches are cleared before each operation to measure cold caches, and filled beforehand to measure warm caches.
+Import time is measured in a new interpreter (at most 20 interpreters per module, as each one takes a while to start).
+
+Run with: python -m tests.benchmark [--iterations 1000] [--concurrency 50] [--json]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import flask
+import httpx
+from jose import jwk, jwt
+from starlette.authentication import SimpleUser
+from starlette.requests import Request
+
+import layabauth
+import layabauth._http
+import layabauth.flask
+import layabauth.starlette
+from tests.conftest import PRIVATE_KEYS
+
+JWKS_URI = "https://test_identity_provider/keys"
+
+
+def jwks() -> dict:
+    return {
+        "keys": [
+            dict(
+                jwk.construct(private_key, "RS256").public_key().to_dict(),
+                kid=kid,
+                use="sig",
+            )
+            for kid, private_key in PRIVATE_KEYS.items()
+        ]
+    }
+
+
+def create_token(kid: str = "key1") -> str:
+    return jwt.encode(
+        {"upn": "user@test", "scopes": ["scope1"], "exp": int(time.time()) + 3600},
+        PRIVATE_KEYS[kid],
+        algorithm="RS256",
+        headers={"kid": kid},
+    )
+
+
+def jwks_transport() -> httpx.MockTransport:
+    """
+    Local JWKs stand-in, serving the test keys.
+    """
+    content = json.dumps(jwks())
+    return httpx.MockTransport(
+        lambda request: httpx.Response(
+            200, text=content, headers={"Cache-Control": "max-age=3600"}
+        )
+    )
+
+
+def verifiers() -> Dict[str, layabauth.Verifier]:
+    available = {"jose": layabauth.JoseVerifier()}
+    try:
+        available["cryptography"] = layabauth.CryptographyVerifier()
+    except ImportError:  # cryptography is an optional dependency
+        pass
+    return available
+
+
+def _report(name: str, latencies: List[float], elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def percentile(ratio: float) -> float:
+        return latencies[round(ratio * (len(latencies) - 1))] * 1e6
+
+    return {
+        "name": name,
+        "iterations": len(latencies),
+        "ops_per_sec": len(latencies) / elapsed,
+        "mean_us": statistics.mean(latencies) * 1e6,
+        "p50_us": percentile(0.5),
+        "p90_us": percentile(0.9),
+        "p99_us": percentile(0.99),
+        "max_us": latencies[-1] * 1e6,
+    }
+
+
+def measure(
+    name: str,
+    operation: Callable[[], object],
+    iterations: int,
+    before: Optional[Callable[[], object]] = None,
+) -> dict:
+    """
+    :param before: Called before every operation, not measured (such as clearing caches).
+    """
+    latencies = []
+    for _ in range(iterations):
+        if before:
+            before()
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    return _report(name, latencies, sum(latencies))
+
+
+def measure_concurrently(
+    name: str,
+    operation: Callable[[], object],
+    iterations: int,
+    concurrency: int,
+    before: Optional[Callable[[], object]] = None,
+) -> dict:
+    """
+    Run batches of concurrent coroutines on the same event loop.
+    Latency of each operation includes the time spent waiting for other coroutines.
+
+    :param before: Called before every batch, not measured (such as clearing caches).
+    """
+
+    async def timed() -> float:
+        start = time.perf_counter()
+        await operation()
+        return time.perf_counter() - start
+
+    async def run() -> dict:
+        latencies, elapsed = [], 0
+        for _ in range(max(iterations // concurrency, 1)):
+            if before:
+                before()
+            start = time.perf_counter()
+            latencies.extend(
+                await asyncio.gather(*(timed() for _ in range(concurrency)))
+            )
+            elapsed += time.perf_counter() - start
+        return _report(name, latencies, elapsed)
+
+    return asyncio.run(run())
+
+
+def _import_duration(module: str) -> float:
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    return float(
+        subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True, text=True
+        ).stdout
+    )
+
+
+def import_time(iterations: int) -> List[dict]:
+    results = []
+    for module in ("layabauth", "layabauth.flask", "layabauth.starlette"):
+        latencies = [_import_duration(module) for _ in range(min(iterations, 20))]
+        results.append(_report(f"import {module}", latencies, sum(latencies)))
+    return results
+
+
+def get_token(iterations: int) -> List[dict]:
+    headers = {"Authorization": f"Bearer {create_token()}"}
+    return [
+        measure("get_token", lambda: layabauth._http._get_token(headers), iterations)
+    ]
+
+
+def validate(iterations: int) -> List[dict]:
+    token, text = create_token(), json.dumps(jwks())
+    results = []
+    for verifier_name, verifier in verifiers().items():
+        # Keys are parsed (and constructed) on first use
+        results.append(
+            measure(
+                f"validate[{verifier_name}] cold",
+                lambda: layabauth._http.validate(
+                    token, layabauth._http.KeySet(text, verifier)
+                ),
+                iterations,
+            )
+        )
+        keys = layabauth._http.KeySet(text, verifier)
+        layabauth._http.validate(token, keys)
+        results.append(
+            measure(
+                f"validate[{verifier_name}] warm",
+                lambda: layabauth._http.validate(token, keys),
+                iterations,
+            )
+        )
+    return results
+
+
+def flask_request(iterations: int) -> List[dict]:
+    keys_cache, token_cache = layabauth.KeysCache(), layabauth.TokenCache()
+    application = flask.Flask(__name__)
+
+    @application.route("/keys_cache")
+    @layabauth.flask.requires_authentication(
+        JWKS_URI, keys_cache=keys_cache, transport=jwks_transport()
+    )
+    def keys_cache_endpoint():
+        return ""
+
+    @application.route("/token_cache")
+    @layabauth.flask.requires_authentication(
+        JWKS_URI,
+        keys_cache=keys_cache,
+        token_cache=token_cache,
+        transport=jwks_transport(),
+    )
+    def token_cache_endpoint():
+        return ""
+
+    client = application.test_client()
+    headers = {"Authorization": f"Bearer {create_token()}"}
+
+    def request(path: str):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200, response.data
+
+    def clear():
+        keys_cache.clear()
+        token_cache.clear()
+
+    return [
+        measure(
+            "flask request cold",
+            lambda: request("/keys_cache"),
+            iterations,
+            before=clear,
+        ),
+        measure("flask request warm", lambda: request("/keys_cache"), iterations),
+        measure(
+            "flask request warm (token cache)",
+            lambda: request("/token_cache"),
+            iterations,
+        ),
+    ]
+
+
+def starlette_authenticate(iterations: int, concurrency: int) -> List[dict]:
+    keys_cache = layabauth.KeysCache()
+    backend = layabauth.starlette.OAuth2IdTokenBackend(
+        jwks_uri=JWKS_URI,
+        create_user=lambda token, token_body: SimpleUser(token_body["upn"]),
+        scopes=lambda token, token_body: token_body["scopes"],
+        keys_cache=keys_cache,
+        transport=jwks_transport(),
+    )
+    request = Request(
+        {
+            "type": "http",
+            "headers": [(b"authorization", f"Bearer {create_token()}".encode())],
+        }
+    )
+
+    async def authenticate():
+        credentials, user = await backend.authenticate(request)
+        assert user.display_name == "user@test"
+
+    results = [
+        measure_concurrently(
+            f"starlette authenticate cold (concurrency {concurrency})",
+            authenticate,
+            iterations,
+            concurrency,
+            before=keys_cache.clear,
+        ),
+        measure_concurrently(
+            f"starlette authenticate warm (concurrency {concurrency})",
+            authenticate,
+            iterations,
+            concurrency,
+        ),
+    ]
+    asyncio.run(backend.close())
+    return results
+
+
+def user_id_filter(iterations: int) -> List[dict]:
+    application = flask.Flask(__name__)
+    flask_filter = layabauth.flask.UserIdFilter("upn")
+    record = logging.makeLogRecord({})
+    headers = {"Authorization": f"Bearer {create_token()}"}
+
+    def first_record():
+        # The user identifier is extracted on the first record of a request
+        with application.test_request_context(headers=headers):
+            flask_filter.filter(record)
+
+    with application.test_request_context(headers=headers):
+        flask_filter.filter(record)
+        results = [
+            measure(
+                "flask UserIdFilter warm",
+                lambda: flask_filter.filter(record),
+                iterations,
+            )
+        ]
+    results.insert(
+        0, measure("flask UserIdFilter cold (request)", first_record, iterations)
+    )
+
+    starlette_filter = layabauth.starlette.UserIdFilter("upn")
+
+    def request_context() -> dict:
+        # As set by the backend while authenticating the request
+        layabauth.starlette._token_body.set({"upn": "user@test"})
+        return measure(
+            "starlette UserIdFilter",
+            lambda: starlette_filter.filter(record),
+            iterations,
+        )
+
+    results.append(contextvars.copy_context().run(request_context))
+    return results
+
+
+def run(iterations: int = 1000, concurrency: int = 50) -> List[dict]:
+    return [
+        *import_time(iterations),
+        *get_token(iterations),
+        *validate(iterations),
+        *flask_request(iterations),
+        *starlette_authenticate(iterations, concurrency),
+        *user_id_filter(iterations),
+    ]
+
+
+def _table(results: List[dict]) -> str:
+    lines = [
+        f"{'benchmark':<50} {'ops/sec':>12} {'p50 (µs)':>10} {'p90 (µs)':>10} {'p99 (µs)':>10} {'max (µs)':>10}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['name']:<50} {result['ops_per_sec']:>12.0f} {result['p50_us']:>10.1f} "
+            f"{result['p90_us']:>10.1f} {result['p99_us']:>10.1f} {result['max_us']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    arguments = parser.parse_args()
+    results = run(arguments.iterations, arguments.concurrency)
+    print(json.dumps(results, indent=4) if arguments.json else _table(results))
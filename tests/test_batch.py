@@ -0,0 +1,146 @@
+import concurrent.futures
+
+import httpx
+import pytest
+from jose import exceptions, jwt
+
+import layabauth
+from tests.conftest import PRIVATE_KEYS
+
+
+@pytest.fixture
+def issuers_jwks(httpx_mock, jwks: dict) -> dict:
+    httpx_mock.add_response(
+        url="https://first_identity_provider", json={"keys": jwks["keys"][:1]}
+    )
+    httpx_mock.add_response(
+        url="https://second_identity_provider", json={"keys": jwks["keys"][1:]}
+    )
+    return {
+        "https://first_issuer": "https://first_identity_provider",
+        "https://second_issuer": "https://second_identity_provider",
+    }
+
+
+def test_tokens_are_validated(httpx_mock, jwks: dict, create_token):
+    httpx_mock.add_response(url="https://test_identity_provider", json=jwks)
+    first, second = create_token({"upn": "first"}), create_token(
+        {"upn": "second"}, "key2"
+    )
+    mis_signed = jwt.encode(
+        {"upn": "third"},
+        PRIVATE_KEYS["key2"],
+        algorithm="RS256",
+        headers={"kid": "key1"},
+    )
+
+    results = layabauth.validate_many(
+        [first, second, mis_signed, "my_token", first],
+        "https://test_identity_provider",
+        keys_cache=layabauth.KeysCache(),
+    )
+
+    assert results[0] == results[4] == {"upn": "first"}
+    assert results[1] == {"upn": "second"}
+    assert isinstance(results[2], exceptions.JWTError)
+    assert str(results[2]) == "Signature verification failed."
+    assert isinstance(results[3], exceptions.JWTError)
+    assert str(results[3]) == "Not enough segments"
+    # Keys are retrieved once
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_tokens_are_grouped_per_issuer(issuers_jwks: dict, httpx_mock, create_token):
+    tokens = [
+        create_token({"iss": "https://first_issuer"}, "key1"),
+        create_token({"iss": "https://second_issuer"}, "key2"),
+        create_token({"iss": "https://first_issuer", "upn": "other"}, "key1"),
+        create_token({"iss": "https://other_issuer"}),
+    ]
+
+    results = layabauth.validate_many(
+        tokens, issuers_jwks, keys_cache=layabauth.KeysCache()
+    )
+
+    assert results[:3] == [
+        {"iss": "https://first_issuer"},
+        {"iss": "https://second_issuer"},
+        {"iss": "https://first_issuer", "upn": "other"},
+    ]
+    assert str(results[3]) == "Invalid issuer"
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_keys_retrieval_failure_is_reported_per_token(httpx_mock, create_token):
+    httpx_mock.add_response(url="https://test_identity_provider", status_code=500)
+    tokens = [create_token({"upn": "first"}), create_token({"upn": "second"})]
+
+    with httpx.Client() as client:
+        results = layabauth.validate_many(
+            tokens,
+            "https://test_identity_provider",
+            keys_cache=layabauth.KeysCache(),
+            client=client,
+        )
+
+    assert [str(result) for result in results] == [
+        "HTTP 500 error while retrieving keys: "
+    ] * 2
+    # Tokens share the same key identifier
+    assert len(httpx_mock.get_requests()) == 1
+
+
+@pytest.mark.parametrize(
+    "verifier", [layabauth.JoseVerifier(), layabauth.CryptographyVerifier()]
+)
+def test_crafted_token_is_reported_per_token(
+    httpx_mock, jwks: dict, create_token, verifier: layabauth.Verifier
+):
+    httpx_mock.add_response(url="https://test_identity_provider", json=jwks)
+    tokens = [
+        jwt.encode({"upn": "first"}, PRIVATE_KEYS["key1"], "RS256", {"kid": ["key1"]}),
+        jwt.encode({"exp": [1]}, PRIVATE_KEYS["key1"], "RS256", {"kid": "key1"}),
+        create_token({"upn": "third"}),
+    ]
+
+    results = layabauth.validate_many(
+        tokens,
+        "https://test_identity_provider",
+        keys_cache=layabauth.KeysCache(verifier=verifier),
+    )
+
+    # Key identifier that is not a string is handled as if not provided
+    assert results[0] == {"upn": "first"}
+    assert isinstance(results[1], exceptions.JWTClaimsError)
+    assert str(results[1]) == "Expiration Time claim (exp) must be an integer."
+    assert results[2] == {"upn": "third"}
+
+
+def test_without_tokens():
+    assert layabauth.validate_many([], "https://test_identity_provider") == []
+
+
+@pytest.mark.parametrize(
+    "executor_type",
+    [concurrent.futures.ThreadPoolExecutor, concurrent.futures.ProcessPoolExecutor],
+)
+def test_tokens_are_validated_in_parallel(
+    issuers_jwks: dict, create_token, executor_type
+):
+    tokens = [
+        create_token({"iss": "https://first_issuer", "id": i}, "key1")
+        for i in range(20)
+    ] + [create_token({"iss": "https://second_issuer"}, "key1")]
+
+    with executor_type(max_workers=2) as executor:
+        results = layabauth.validate_many(
+            tokens,
+            issuers_jwks,
+            keys_cache=layabauth.KeysCache(),
+            executor=executor,
+            chunksize=4,
+        )
+
+    assert results[:20] == [{"iss": "https://first_issuer", "id": i} for i in range(20)]
+    # Unknown key identifier for this issuer
+    assert str(results[20]) == "Signature verification failed."
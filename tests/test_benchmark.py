@@ -0,0 +1,47 @@
+from tests import benchmark
+
+
+def test_benchmarks_are_runnable_offline():
+    results = benchmark.run(iterations=4, concurrency=2)
+
+    assert [result["name"] for result in results] == [
+        "import layabauth",
+        "import layabauth.flask",
+        "import layabauth.starlette",
+        "get_token",
+        "validate[jose] cold",
+        "validate[jose] warm",
+        "validate[cryptography] cold",
+        "validate[cryptography] warm",
+        "flask request cold",
+        "flask request warm",
+        "flask request warm (token cache)",
+        "starlette authenticate cold (concurrency 2)",
+        "starlette authenticate warm (concurrency 2)",
+        "flask UserIdFilter cold (request)",
+        "flask UserIdFilter warm",
+        "starlette UserIdFilter",
+    ]
+    for result in results:
+        assert result["iterations"] == 4
+        assert result["ops_per_sec"] > 0
+        assert result["p50_us"] <= result["p90_us"] <= result["p99_us"]
+        assert result["p99_us"] <= result["max_us"]
+
+
+def test_benchmarks_table():
+    table = benchmark._table(benchmark.get_token(iterations=2))
+
+    assert table.splitlines()[0].split() == [
+        "benchmark",
+        "ops/sec",
+        "p50",
+        "(µs)",
+        "p90",
+        "(µs)",
+        "p99",
+        "(µs)",
+        "max",
+        "(µs)",
+    ]
+    assert table.splitlines()[1].startswith("get_token")
@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from jose import exceptions
+
+import layabauth
+import layabauth._http
+
+
+def test_retrieval_is_suspended_after_consecutive_failures(
+    httpx_client: httpx.Client, httpx_mock
+):
+    httpx_mock.add_exception(httpx.ConnectTimeout("description"))
+    breaker = layabauth.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    cache = layabauth.KeysCache(circuit_breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(exceptions.JOSEError) as exception_info:
+            layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+        assert (
+            str(exception_info.value)
+            == "ConnectTimeout error while retrieving keys: description"
+        )
+    assert breaker.is_open("https://test_identity_provider")
+
+    # Fail fast, without requesting keys
+    with pytest.raises(exceptions.JOSEError) as exception_info:
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+    assert (
+        str(exception_info.value)
+        == "Keys retrieval from https://test_identity_provider is suspended after 2 consecutive failures."
+    )
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_retrieval_is_suspended_per_uri(httpx_client: httpx.Client, httpx_mock):
+    httpx_mock.add_response(url="https://test_identity_provider/1", status_code=500)
+    httpx_mock.add_response(url="https://test_identity_provider/2", text="second")
+    breaker = layabauth.CircuitBreaker(failure_threshold=1)
+    cache = layabauth.KeysCache(circuit_breaker=breaker)
+
+    with pytest.raises(exceptions.JOSEError):
+        layabauth._http.keys(httpx_client, "https://test_identity_provider/1", cache)
+    assert (
+        layabauth._http.keys(
+            httpx_client, "https://test_identity_provider/2", cache
+        ).text
+        == "second"
+    )
+    assert breaker.is_open("https://test_identity_provider/1")
+    assert not breaker.is_open("https://test_identity_provider/2")
+
+
+def test_successful_retrieval_resets_failures(httpx_client: httpx.Client, httpx_mock):
+    httpx_mock.add_response(url="https://test_identity_provider", status_code=500)
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    httpx_mock.add_response(url="https://test_identity_provider", status_code=500)
+    breaker = layabauth.CircuitBreaker(failure_threshold=2)
+    cache = layabauth.KeysCache(ttl=0, circuit_breaker=breaker)
+
+    for _ in range(3):
+        try:
+            layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+        except exceptions.JOSEError:
+            pass
+    assert not breaker.is_open("https://test_identity_provider")
+
+
+def test_expired_keys_are_used_while_retrieval_is_suspended(
+    httpx_client: httpx.Client, httpx_mock
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    httpx_mock.add_response(url="https://test_identity_provider", status_code=500)
+    breaker = layabauth.CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    cache = layabauth.KeysCache(ttl=0, grace_period=60, circuit_breaker=breaker)
+
+    for _ in range(3):
+        assert (
+            layabauth._http.keys(
+                httpx_client, "https://test_identity_provider", cache
+            ).text
+            == "first"
+        )
+    assert breaker.is_open("https://test_identity_provider")
+    # The second failure opened the circuit, the third retrieval was not attempted
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_retrieval_is_attempted_again_once_suspension_is_over(
+    httpx_client: httpx.Client, httpx_mock
+):
+    httpx_mock.add_response(url="https://test_identity_provider", status_code=500)
+    httpx_mock.add_response(url="https://test_identity_provider", status_code=503)
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    breaker = layabauth.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    cache = layabauth.KeysCache(circuit_breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(exceptions.JOSEError):
+            layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+        # A failed attempt suspends retrieval again
+        assert breaker.is_open("https://test_identity_provider")
+
+    assert (
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache).text
+        == "first"
+    )
+    assert not breaker.is_open("https://test_identity_provider")
+
+
+def test_a_single_retrieval_is_attempted_once_suspension_is_over():
+    breaker = layabauth.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    with pytest.raises(exceptions.JOSEError):
+        with breaker.guard("https://test_identity_provider"):
+            raise exceptions.JOSEError("failure")
+
+    with breaker.guard("https://test_identity_provider"):
+        with pytest.raises(exceptions.JOSEError) as exception_info:
+            with breaker.guard("https://test_identity_provider"):
+                pass
+        assert (
+            str(exception_info.value)
+            == "Keys retrieval from https://test_identity_provider is suspended after 1 consecutive failures."
+        )
+    assert not breaker.is_open("https://test_identity_provider")
+
+
+def test_interrupted_retrieval_can_be_attempted_again():
+    breaker = layabauth.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    with pytest.raises(exceptions.JOSEError):
+        with breaker.guard("https://test_identity_provider"):
+            raise exceptions.JOSEError("failure")
+
+    with pytest.raises(asyncio.CancelledError):
+        with breaker.guard("https://test_identity_provider"):
+            raise asyncio.CancelledError()
+    assert breaker.is_open("https://test_identity_provider")
+
+    with breaker.guard("https://test_identity_provider"):
+        pass
+    assert not breaker.is_open("https://test_identity_provider")
+
+
+def test_async_retrieval_is_suspended_after_consecutive_failures(httpx_mock):
+    httpx_mock.add_exception(httpx.ConnectTimeout("description"))
+    breaker = layabauth.CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    cache = layabauth.KeysCache(circuit_breaker=breaker)
+
+    async def retrieve_keys():
+        async with httpx.AsyncClient() as client:
+            for _ in range(2):
+                try:
+                    await layabauth._http.async_keys(
+                        client, "https://test_identity_provider", cache
+                    )
+                except exceptions.JOSEError as e:
+                    error = e
+        return error
+
+    start = time.monotonic()
+    assert str(asyncio.run(retrieve_keys())) == (
+        "Keys retrieval from https://test_identity_provider is suspended after 1 consecutive failures."
+    )
+    assert time.monotonic() - start < 1
+    assert len(httpx_mock.get_requests()) == 1
@@ -0,0 +1,57 @@
+import subprocess
+import sys
+
+import pytest
+
+# Modules only required once tokens are validated (or keys retrieved)
+LAZY_MODULES = ("httpx", "jose.jwt", "jose.jws", "jose.jwk", "cryptography")
+
+
+def loaded_modules(code: str) -> list:
+    """
+    Lazily imported modules loaded once code was executed in a new interpreter.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys\n{code}\nprint(*[module for module in {LAZY_MODULES!r} if module in sys.modules])",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.split()
+
+
+@pytest.mark.parametrize(
+    "module", ["layabauth", "layabauth.flask", "layabauth.starlette"]
+)
+def test_import_does_not_load_validation_dependencies(module):
+    assert loaded_modules(f"import {module}") == []
+
+
+def test_flask_import_does_not_load_asyncio():
+    assert (
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, layabauth.flask; sys.exit('asyncio' in sys.modules)",
+            ]
+        ).returncode
+        == 0
+    )
+
+
+def test_validation_loads_validation_dependencies():
+    assert loaded_modules("""
+import layabauth._http
+from jose import exceptions
+layabauth._http.key_identifier("invalid")
+try:
+    layabauth._http.validate("invalid", layabauth._http.KeySet('{"keys": []}'))
+except exceptions.JOSEError:
+    pass
+layabauth._http.Clients().sync()
+""") == list(LAZY_MODULES)
@@ -0,0 +1,255 @@
+import asyncio
+import concurrent.futures
+import time
+
+import flask
+import httpx
+import pytest
+import starlette.applications
+import starlette.testclient
+from jose import exceptions, jwt
+from starlette.authentication import SimpleUser
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse
+
+import layabauth
+import layabauth._http
+import layabauth._instrumentation
+import layabauth.flask
+import layabauth.starlette
+from tests.conftest import PRIVATE_KEYS
+
+
+class RecordingInstrumentation(layabauth.Instrumentation):
+    def __init__(self):
+        self.events = []
+
+    def keys_retrieved(self, jwks_uri, duration, status_code):
+        assert duration >= 0
+        self.events.append(("keys_retrieved", jwks_uri, status_code))
+
+    def keys_cache_hit(self, jwks_uri):
+        self.events.append(("keys_cache_hit", jwks_uri))
+
+    def keys_cache_miss(self, jwks_uri):
+        self.events.append(("keys_cache_miss", jwks_uri))
+
+    def stale_keys_used(self, jwks_uri, staleness):
+        assert staleness >= 0
+        self.events.append(("stale_keys_used", jwks_uri))
+
+    def token_validated(self, jwks_uri, duration):
+        assert duration >= 0
+        self.events.append(("token_validated", jwks_uri))
+
+    def token_rejected(self, reason):
+        self.events.append(("token_rejected", reason))
+
+
+def test_events_are_ignored_by_default(httpx_client: httpx.Client, httpx_mock):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    instrumentation = layabauth.Instrumentation()
+    instrumentation.token_validated("https://test_identity_provider", 0)
+    instrumentation.token_rejected("keys")
+    instrumentation.stale_keys_used("https://test_identity_provider", 0)
+
+    assert (
+        layabauth._http.keys(
+            httpx_client, "https://test_identity_provider", layabauth.KeysCache()
+        ).text
+        == "first"
+    )
+
+
+def test_keys_cache_events(httpx_client: httpx.Client, httpx_mock):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    httpx_mock.add_response(url="https://test_identity_provider", status_code=500)
+    instrumentation = RecordingInstrumentation()
+    cache = layabauth.KeysCache(grace_period=60, instrumentation=instrumentation)
+
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+    cache._keys["https://test_identity_provider"].expiry = time.monotonic() - 1
+    # Expired keys cannot be refreshed
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+
+    assert instrumentation.events == [
+        ("keys_cache_miss", "https://test_identity_provider"),
+        ("keys_retrieved", "https://test_identity_provider", 200),
+        ("keys_cache_hit", "https://test_identity_provider"),
+        ("keys_cache_miss", "https://test_identity_provider"),
+        ("keys_retrieved", "https://test_identity_provider", 500),
+        ("stale_keys_used", "https://test_identity_provider"),
+    ]
+
+
+def test_forced_refresh_is_not_a_cache_lookup(httpx_client: httpx.Client, httpx_mock):
+    httpx_mock.add_exception(httpx.ConnectError("description"))
+    instrumentation = RecordingInstrumentation()
+    cache = layabauth.KeysCache(instrumentation=instrumentation)
+
+    with pytest.raises(exceptions.JOSEError):
+        cache.refresh(httpx_client, "https://test_identity_provider")
+
+    assert instrumentation.events == [
+        ("keys_retrieved", "https://test_identity_provider", None)
+    ]
+
+
+def test_async_keys_cache_events(httpx_mock):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    httpx_mock.add_exception(httpx.ConnectError("description"))
+    instrumentation = RecordingInstrumentation()
+    cache = layabauth.KeysCache(grace_period=60, instrumentation=instrumentation)
+
+    async def retrieve_keys():
+        async with httpx.AsyncClient() as client:
+            await layabauth._http.async_keys(
+                client, "https://test_identity_provider", cache
+            )
+            await layabauth._http.async_keys(
+                client, "https://test_identity_provider", cache
+            )
+            cache._keys["https://test_identity_provider"].expiry = time.monotonic() - 1
+            await layabauth._http.async_keys(
+                client, "https://test_identity_provider", cache
+            )
+
+    asyncio.run(retrieve_keys())
+    assert instrumentation.events == [
+        ("keys_cache_miss", "https://test_identity_provider"),
+        ("keys_retrieved", "https://test_identity_provider", 200),
+        ("keys_cache_hit", "https://test_identity_provider"),
+        ("keys_cache_miss", "https://test_identity_provider"),
+        ("keys_retrieved", "https://test_identity_provider", None),
+        ("stale_keys_used", "https://test_identity_provider"),
+    ]
+
+
+def test_stale_keys_are_used_while_being_refreshed():
+    instrumentation = RecordingInstrumentation()
+    cache = layabauth.KeysCache(grace_period=60, instrumentation=instrumentation)
+    cache._keys["https://test_identity_provider"] = layabauth._http._CachedKeys(
+        layabauth._http.KeySet("first"), time.monotonic() - 1, None, None
+    )
+    cache._refreshing["https://test_identity_provider"] = concurrent.futures.Future()
+
+    assert cache.get(httpx.Client(), "https://test_identity_provider").text == "first"
+    assert instrumentation.events == [
+        ("stale_keys_used", "https://test_identity_provider")
+    ]
+
+
+def test_async_stale_keys_are_used_while_being_refreshed():
+    instrumentation = RecordingInstrumentation()
+    cache = layabauth.KeysCache(grace_period=60, instrumentation=instrumentation)
+    cache._keys["https://test_identity_provider"] = layabauth._http._CachedKeys(
+        layabauth._http.KeySet("first"), time.monotonic() - 1, None, None
+    )
+
+    async def retrieve_keys():
+        loop = asyncio.get_running_loop()
+        cache._async_refreshing[(loop, "https://test_identity_provider")] = (
+            loop.create_future()
+        )
+        return await cache.async_get(
+            httpx.AsyncClient(), "https://test_identity_provider"
+        )
+
+    assert asyncio.run(retrieve_keys()).text == "first"
+    assert instrumentation.events == [
+        ("stale_keys_used", "https://test_identity_provider")
+    ]
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (exceptions.ExpiredSignatureError("Signature has expired."), "expired"),
+        (exceptions.JWTClaimsError("Invalid issuer"), "claims"),
+        (exceptions.JWTError("Signature verification failed."), "signature"),
+        (exceptions.JWTError("Not enough segments"), "malformed"),
+        (exceptions.JOSEError("HTTP 500 error while retrieving keys: "), "keys"),
+    ],
+)
+def test_failure_reason(error: exceptions.JOSEError, expected: str):
+    assert layabauth._instrumentation.failure_reason(error) == expected
+
+
+def tokens() -> dict:
+    return {
+        "valid": jwt.encode({}, PRIVATE_KEYS["key1"], algorithm="RS256"),
+        "expired": jwt.encode({"exp": 0}, PRIVATE_KEYS["key1"], algorithm="RS256"),
+        "signature": jwt.encode(
+            {}, PRIVATE_KEYS["key2"], algorithm="RS256", headers={"kid": "key1"}
+        ),
+        "malformed": "my_token",
+    }
+
+
+def test_flask_events(httpx_mock, jwks: dict):
+    httpx_mock.add_response(url="https://test_identity_provider", json=jwks)
+    instrumentation = RecordingInstrumentation()
+    application = flask.Flask(__name__)
+
+    @application.route("/requires_authentication")
+    @layabauth.flask.requires_authentication(
+        "https://test_identity_provider",
+        keys_cache=layabauth.KeysCache(instrumentation=instrumentation),
+    )
+    def requires_authentication():
+        return ""
+
+    for token in tokens().values():
+        application.test_client().get(
+            "/requires_authentication", headers={"Authorization": f"Bearer {token}"}
+        )
+
+    assert [
+        event for event in instrumentation.events if event[0] == "token_validated"
+    ] == [("token_validated", "https://test_identity_provider")]
+    assert [
+        event for event in instrumentation.events if event[0] == "token_rejected"
+    ] == [
+        ("token_rejected", "expired"),
+        ("token_rejected", "signature"),
+        ("token_rejected", "malformed"),
+    ]
+
+
+def test_starlette_events(httpx_mock, jwks: dict):
+    httpx_mock.add_response(url="https://test_identity_provider", json=jwks)
+    instrumentation = RecordingInstrumentation()
+    backend = layabauth.starlette.OAuth2IdTokenBackend(
+        jwks_uri="https://test_identity_provider",
+        create_user=lambda token, token_body: SimpleUser(""),
+        scopes=lambda token, token_body: [],
+        keys_cache=layabauth.KeysCache(instrumentation=instrumentation),
+    )
+    application = starlette.applications.Starlette(
+        middleware=[
+            Middleware(layabauth.starlette.OAuth2IdTokenMiddleware, backend=backend)
+        ]
+    )
+
+    @application.route("/requires_authentication")
+    async def requires_authentication(request):
+        return PlainTextResponse("")
+
+    with starlette.testclient.TestClient(application) as client:
+        for token in tokens().values():
+            client.get(
+                "/requires_authentication",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+
+    assert [
+        event for event in instrumentation.events if event[0] == "token_validated"
+    ] == [("token_validated", "https://test_identity_provider")]
+    assert [
+        event for event in instrumentation.events if event[0] == "token_rejected"
+    ] == [
+        ("token_rejected", "expired"),
+        ("token_rejected", "signature"),
+        ("token_rejected", "malformed"),
+    ]
@@ -0,0 +1,52 @@
+import prometheus_client
+
+import layabauth.prometheus
+
+
+def test_metrics_are_reported():
+    registry = prometheus_client.CollectorRegistry()
+    instrumentation = layabauth.prometheus.PrometheusInstrumentation(registry)
+
+    instrumentation.keys_retrieved("https://test_identity_provider", 0.5, 200)
+    instrumentation.keys_retrieved("https://test_identity_provider", 2, None)
+    instrumentation.keys_cache_hit("https://test_identity_provider")
+    instrumentation.keys_cache_hit("https://test_identity_provider")
+    instrumentation.keys_cache_miss("https://test_identity_provider")
+    instrumentation.stale_keys_used("https://test_identity_provider", 10)
+    instrumentation.token_validated("https://test_identity_provider", 0.001)
+    instrumentation.token_rejected("signature")
+
+    def value(name: str, **labels) -> float:
+        return registry.get_sample_value(name, labels)
+
+    uri = "https://test_identity_provider"
+    assert (
+        value("layabauth_keys_retrieval_seconds_sum", jwks_uri=uri, status="200") == 0.5
+    )
+    assert (
+        value("layabauth_keys_retrieval_seconds_sum", jwks_uri=uri, status="error") == 2
+    )
+    assert value("layabauth_keys_cache_lookups_total", jwks_uri=uri, result="hit") == 2
+    assert value("layabauth_keys_cache_lookups_total", jwks_uri=uri, result="miss") == 1
+    assert (
+        value("layabauth_keys_cache_lookups_total", jwks_uri=uri, result="stale") == 1
+    )
+    assert value("layabauth_stale_keys_seconds_sum", jwks_uri=uri) == 10
+    assert value("layabauth_token_validation_seconds_count", jwks_uri=uri) == 1
+    assert value("layabauth_token_rejections_total", reason="signature") == 1
+
+
+def test_metrics_namespace():
+    registry = prometheus_client.CollectorRegistry()
+    instrumentation = layabauth.prometheus.PrometheusInstrumentation(
+        registry, namespace="my_application"
+    )
+
+    instrumentation.token_rejected("expired")
+
+    assert (
+        registry.get_sample_value(
+            "my_application_token_rejections_total", {"reason": "expired"}
+        )
+        == 1
+    )
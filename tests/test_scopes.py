@@ -0,0 +1,40 @@
+import pytest
+
+import layabauth._scopes
+
+
+@pytest.mark.parametrize(
+    "scopes, expected",
+    [
+        (None, frozenset()),
+        ([], frozenset()),
+        (["scope1", "scope2"], frozenset({"scope1", "scope2"})),
+        ("scope1 scope2", frozenset({"scope1", "scope2"})),
+    ],
+)
+def test_provided_scopes(scopes, expected: frozenset):
+    assert layabauth._scopes.provided_scopes(scopes) == expected
+
+
+@pytest.mark.parametrize(
+    "expected_scopes, any_of, expected",
+    [
+        ((), False, None),
+        ((), True, None),
+        (("scope1", "scope2"), False, None),
+        (("scope2", "scope3"), False, "The scope3 must be provided in the token."),
+        (("scope3", "scope1"), True, None),
+        (
+            ("scope3", "scope4"),
+            True,
+            "One of the scope3, scope4 scopes must be provided in the token.",
+        ),
+    ],
+)
+def test_expected_scopes(expected_scopes: tuple, any_of: bool, expected):
+    assert (
+        layabauth._scopes.ExpectedScopes(expected_scopes, any_of).missing(
+            frozenset({"scope1", "scope2"})
+        )
+        == expected
+    )
@@ -0,0 +1,713 @@
+import asyncio
+import concurrent.futures
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import pytest
+
+import layabauth
+import layabauth._http
+import layabauth._shared
+
+
+def process_cache(directory, **kwargs) -> layabauth.KeysCache:
+    """
+    Keys cache as it would be created by each worker process.
+    """
+    return layabauth.KeysCache(shared=layabauth.SharedKeys(str(directory)), **kwargs)
+
+
+def test_keys_retrieved_by_a_process_are_used_by_other_processes(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    first_process = process_cache(tmp_path)
+    second_process = process_cache(tmp_path)
+
+    first = layabauth._http.keys(
+        httpx_client, "https://test_identity_provider", first_process
+    )
+    second = layabauth._http.keys(
+        httpx_client, "https://test_identity_provider", second_process
+    )
+    assert first.text == second.text == "first"
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_keys_from_other_processes_are_parsed_once_per_process(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    layabauth._http.keys(
+        httpx_client, "https://test_identity_provider", process_cache(tmp_path)
+    )
+    second_process = layabauth.SharedKeys(str(tmp_path))
+
+    first = layabauth._http.keys(
+        httpx_client,
+        "https://test_identity_provider",
+        layabauth.KeysCache(shared=second_process),
+    )
+    second = layabauth._http.keys(
+        httpx_client,
+        "https://test_identity_provider",
+        layabauth.KeysCache(shared=second_process),
+    )
+    assert first is second
+
+
+def test_shared_keys_are_only_loaded_once_changed(tmp_path):
+    shared = layabauth.SharedKeys(str(tmp_path))
+
+    first_version = shared.save("https://test_identity_provider", {"keys": "first"})
+    assert shared.load("https://test_identity_provider") == (
+        first_version,
+        {"keys": "first", "jwks_uri": "https://test_identity_provider"},
+    )
+    assert shared.load("https://test_identity_provider", first_version) == (
+        first_version,
+        None,
+    )
+
+    second_version = shared.save("https://test_identity_provider", {"keys": "second"})
+    assert second_version != first_version
+    assert shared.load("https://test_identity_provider", first_version) == (
+        second_version,
+        {"keys": "second", "jwks_uri": "https://test_identity_provider"},
+    )
+
+
+def test_cleared_cache_loads_shared_keys_again(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    cache = process_cache(tmp_path)
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+
+    cache.clear()
+    assert (
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache).text
+        == "first"
+    )
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_expired_shared_keys_are_not_used(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(
+        url="https://test_identity_provider",
+        text="first",
+        headers={"Cache-Control": "no-cache"},
+    )
+    httpx_mock.add_response(url="https://test_identity_provider", text="second")
+    layabauth._http.keys(
+        httpx_client,
+        "https://test_identity_provider",
+        process_cache(tmp_path, min_ttl=0),
+    )
+
+    assert (
+        layabauth._http.keys(
+            httpx_client,
+            "https://test_identity_provider",
+            process_cache(tmp_path, min_ttl=0),
+        ).text
+        == "second"
+    )
+
+
+def test_shared_keys_are_kept_if_not_modified(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(
+        url="https://test_identity_provider",
+        text="first",
+        headers={"ETag": '"1"', "Cache-Control": "no-cache"},
+    )
+    httpx_mock.add_response(
+        url="https://test_identity_provider",
+        match_headers={"If-None-Match": '"1"'},
+        status_code=304,
+    )
+    first_process = process_cache(tmp_path, min_ttl=0)
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", first_process)
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", first_process)
+
+    assert (
+        layabauth._http.keys(
+            httpx_client,
+            "https://test_identity_provider",
+            process_cache(tmp_path, min_ttl=0),
+        ).text
+        == "first"
+    )
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_refresh_uses_keys_refreshed_by_another_process(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    httpx_mock.add_response(url="https://test_identity_provider", text="second")
+    first_process = process_cache(tmp_path)
+    second_process = process_cache(tmp_path)
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", first_process)
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", second_process)
+
+    assert first_process.refresh(
+        httpx_client, "https://test_identity_provider"
+    ).text == ("second")
+    assert second_process.refresh(
+        httpx_client, "https://test_identity_provider"
+    ).text == ("second")
+    assert len(httpx_mock.get_requests()) == 2
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "not json",
+        "[]",
+        '{"jwks_uri": "https://other_identity_provider", "keys": "other", "expires": 0}',
+        '{"jwks_uri": "https://test_identity_provider", "expires": 9999999999}',
+        '{"jwks_uri": "https://test_identity_provider", "keys": "other", "expires": "never"}',
+    ],
+)
+def test_invalid_shared_keys_are_ignored(
+    httpx_client: httpx.Client, httpx_mock, tmp_path, content: str
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    shared = layabauth.SharedKeys(str(tmp_path))
+    with open(shared._path("https://test_identity_provider", "json"), "w") as file:
+        file.write(content)
+
+    assert (
+        layabauth._http.keys(
+            httpx_client,
+            "https://test_identity_provider",
+            layabauth.KeysCache(shared=shared),
+        ).text
+        == "first"
+    )
+
+
+def test_keys_are_not_shared_if_they_cannot_be_saved(
+    httpx_client: httpx.Client, httpx_mock, tmp_path, caplog
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    cache = process_cache(tmp_path / "missing")
+
+    assert (
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache).text
+        == "first"
+    )
+    assert [record.getMessage() for record in caplog.records] == [
+        "Unable to lock keys retrieval from https://test_identity_provider.",
+        "Unable to share keys from https://test_identity_provider.",
+    ]
+
+
+def test_temporary_file_is_removed_if_keys_cannot_be_shared(
+    tmp_path, monkeypatch, caplog
+):
+    def failing_replace(source, destination):
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(os, "replace", failing_replace)
+    shared = layabauth.SharedKeys(str(tmp_path))
+    shared.save("https://test_identity_provider", {"keys": "first"})
+
+    assert os.listdir(tmp_path) == []
+    assert shared.load("https://test_identity_provider") == (None, None)
+    assert caplog.records[0].getMessage() == (
+        "Unable to share keys from https://test_identity_provider."
+    )
+
+
+def test_lock_is_held_by_another_process(tmp_path):
+    first_process = layabauth.SharedKeys(str(tmp_path))
+    second_process = layabauth.SharedKeys(str(tmp_path))
+
+    with first_process.lock("https://test_identity_provider") as locked:
+        assert locked
+        with second_process.lock(
+            "https://test_identity_provider", blocking=False
+        ) as other_locked:
+            assert not other_locked
+        with second_process.lock(
+            "https://other_identity_provider", blocking=False
+        ) as other_locked:
+            assert other_locked
+
+    with second_process.lock(
+        "https://test_identity_provider", blocking=False
+    ) as other_locked:
+        assert other_locked
+
+
+def test_lock_wait_is_limited(tmp_path):
+    first_process = layabauth.SharedKeys(str(tmp_path))
+    second_process = layabauth.SharedKeys(str(tmp_path))
+
+    with first_process.lock("https://test_identity_provider"):
+        start = time.monotonic()
+        with second_process.lock(
+            "https://test_identity_provider", timeout=0.1
+        ) as other_locked:
+            assert not other_locked
+        assert time.monotonic() - start >= 0.1
+
+    with second_process.lock(
+        "https://test_identity_provider", timeout=0.1
+    ) as other_locked:
+        assert other_locked
+
+
+def test_keys_are_retrieved_if_another_process_holds_the_lock_for_too_long(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    other_process = layabauth.SharedKeys(str(tmp_path))
+    cache = process_cache(tmp_path, timeout=0.1)
+
+    with other_process.lock("https://test_identity_provider"):
+        keys = layabauth._http.keys(
+            httpx_client, "https://test_identity_provider", cache
+        )
+
+    assert keys.text == "first"
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_coroutines_retrieve_keys_if_another_process_holds_the_lock_for_too_long(
+    httpx_mock, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(layabauth._http, "_SHARED_LOCK_DELAY", 0.01)
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    other_process = layabauth.SharedKeys(str(tmp_path))
+    cache = process_cache(tmp_path, timeout=0.1)
+
+    async def retrieve_keys():
+        async with httpx.AsyncClient() as client:
+            return await layabauth._http.async_keys(
+                client, "https://test_identity_provider", cache
+            )
+
+    with other_process.lock("https://test_identity_provider"):
+        assert asyncio.run(retrieve_keys()).text == "first"
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_lock_is_not_available_without_fcntl(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "fcntl", None)
+    spec = importlib.util.spec_from_file_location(
+        "shared_without_fcntl", layabauth._shared.__file__
+    )
+    shared = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(shared)
+
+    with shared.SharedKeys(str(tmp_path)).lock(
+        "https://test_identity_provider"
+    ) as locked:
+        assert locked
+    assert os.listdir(tmp_path) == []
+
+
+def test_coroutines_wait_for_keys_retrieved_by_another_process(
+    httpx_mock, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(layabauth._http, "_SHARED_LOCK_DELAY", 0.01)
+    other_process = layabauth.SharedKeys(str(tmp_path))
+    cache = process_cache(tmp_path)
+
+    async def retrieve_keys():
+        async with httpx.AsyncClient() as client:
+            with other_process.lock("https://test_identity_provider"):
+                retrieval = asyncio.ensure_future(
+                    layabauth._http.async_keys(
+                        client, "https://test_identity_provider", cache
+                    )
+                )
+                await asyncio.sleep(0.05)
+                assert not retrieval.done()
+                other_process.save(
+                    "https://test_identity_provider",
+                    {"keys": "other", "expires": time.time() + 60},
+                )
+            return await retrieval
+
+    assert asyncio.run(retrieve_keys()).text == "other"
+    assert not httpx_mock.get_requests()
+
+
+def test_async_keys_retrieved_by_a_process_are_used_by_other_processes(
+    httpx_mock, tmp_path
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+
+    async def retrieve_keys(cache: layabauth.KeysCache):
+        async with httpx.AsyncClient() as client:
+            return await layabauth._http.async_keys(
+                client, "https://test_identity_provider", cache
+            )
+
+    assert asyncio.run(retrieve_keys(process_cache(tmp_path))).text == "first"
+    assert asyncio.run(retrieve_keys(process_cache(tmp_path))).text == "first"
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_default_directory(monkeypatch):
+    directory = layabauth.SharedKeys().directory
+    assert directory == os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        f"layabauth-{os.getuid()}",
+    )
+    stat = os.stat(directory)
+    assert stat.st_uid == os.getuid()
+    assert stat.st_mode & 0o777 == 0o700
+
+
+def test_default_directory_within_temporary_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(os.path, "isdir", lambda path: False)
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    assert layabauth.SharedKeys().directory == str(
+        tmp_path / f"layabauth-{os.getuid()}"
+    )
+    # Directory already exists
+    assert layabauth.SharedKeys().directory == str(
+        tmp_path / f"layabauth-{os.getuid()}"
+    )
+
+
+def test_default_directory_without_user_identifier(tmp_path, monkeypatch):
+    monkeypatch.setattr(os.path, "isdir", lambda path: False)
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    monkeypatch.delattr(os, "getuid")
+    shared = layabauth.SharedKeys()
+    assert shared.directory == str(tmp_path / "layabauth")
+    # Ownership cannot be checked
+    shared.save("https://test_identity_provider", {"keys": "first"})
+    os.chmod(shared._path("https://test_identity_provider", "json"), 0o666)
+    assert shared.load("https://test_identity_provider")[1]["keys"] == "first"
+
+
+def other_user(monkeypatch):
+    uid = os.getuid() + 1
+    monkeypatch.setattr(layabauth._shared, "_uid", lambda: uid)
+
+
+@pytest.fixture
+def default_directory(tmp_path, monkeypatch) -> str:
+    monkeypatch.setattr(os.path, "isdir", lambda path: False)
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    return str(tmp_path / f"layabauth-{os.getuid()}")
+
+
+def assert_keys_are_not_shared(shared: layabauth.SharedKeys):
+    assert shared.directory is None
+    assert shared.save("https://test_identity_provider", {"keys": "first"}) is None
+    assert shared.load("https://test_identity_provider") == (None, None)
+    with shared.lock("https://test_identity_provider") as locked:
+        assert locked
+
+
+def test_default_directory_created_by_another_user_is_not_used(
+    tmp_path, monkeypatch, caplog
+):
+    monkeypatch.setattr(os.path, "isdir", lambda path: False)
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    other_user(monkeypatch)
+    # Created by the current user, before the other user
+    directory = tmp_path / f"layabauth-{os.getuid() + 1}"
+    os.mkdir(directory, 0o700)
+
+    assert_keys_are_not_shared(layabauth.SharedKeys())
+    assert caplog.messages == [
+        f"Keys are not shared as {directory} is not a directory only accessible by the current user."
+    ]
+
+
+def test_default_directory_accessible_by_other_users_is_not_used(
+    default_directory: str, caplog
+):
+    os.mkdir(default_directory)
+    os.chmod(default_directory, 0o755)
+
+    assert_keys_are_not_shared(layabauth.SharedKeys())
+    assert caplog.messages == [
+        f"Keys are not shared as {default_directory} is not a directory only accessible by the current user."
+    ]
+
+
+def test_default_directory_symbolic_link_is_not_used(
+    default_directory: str, tmp_path, caplog
+):
+    os.mkdir(tmp_path / "target", 0o700)
+    os.symlink(tmp_path / "target", default_directory)
+
+    assert_keys_are_not_shared(layabauth.SharedKeys())
+    assert caplog.messages == [
+        f"Keys are not shared as {default_directory} is not a directory only accessible by the current user."
+    ]
+
+
+def test_default_directory_cannot_be_created(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(os.path, "isdir", lambda path: False)
+    # Parent is not a directory
+    (tmp_path / "file").write_text("")
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path / "file"))
+
+    assert_keys_are_not_shared(layabauth.SharedKeys())
+    assert caplog.messages == [
+        f"Unable to create shared keys directory {tmp_path / 'file' / f'layabauth-{os.getuid()}'}."
+    ]
+
+
+def test_keys_shared_by_another_user_are_ignored(tmp_path, monkeypatch, caplog):
+    shared = layabauth.SharedKeys(str(tmp_path))
+    shared.save("https://test_identity_provider", {"keys": "injected"})
+    other_user(monkeypatch)
+
+    version, entry = shared.load("https://test_identity_provider")
+    assert version
+    assert entry is None
+    assert caplog.messages == [
+        f"Ignoring untrusted shared keys file {shared._path('https://test_identity_provider', 'json')}."
+    ]
+
+
+def test_keys_writable_by_other_users_are_ignored(tmp_path):
+    shared = layabauth.SharedKeys(str(tmp_path))
+    shared.save("https://test_identity_provider", {"keys": "injected"})
+    os.chmod(shared._path("https://test_identity_provider", "json"), 0o646)
+
+    assert shared.load("https://test_identity_provider")[1] is None
+
+
+def test_lock_held_by_another_user_is_ignored(tmp_path, monkeypatch, caplog):
+    shared = layabauth.SharedKeys(str(tmp_path))
+    with shared.lock("https://test_identity_provider"):
+        other_user(monkeypatch)
+        # Lock file is not owned by the current user, keys retrieval is not blocked
+        with shared.lock("https://test_identity_provider", blocking=False) as locked:
+            assert locked
+    assert caplog.messages == [
+        f"Ignoring untrusted shared keys lock file {shared._path('https://test_identity_provider', 'lock')}."
+    ]
+
+
+def test_lock_file_is_only_writable_by_the_current_user(tmp_path):
+    shared = layabauth.SharedKeys(str(tmp_path))
+    with shared.lock("https://test_identity_provider"):
+        pass
+    stat = os.stat(shared._path("https://test_identity_provider", "lock"))
+    assert stat.st_mode & 0o777 == 0o600
+
+
+def test_shared_keys_content(httpx_client: httpx.Client, httpx_mock, tmp_path):
+    httpx_mock.add_response(
+        url="https://test_identity_provider",
+        text="first",
+        headers={"ETag": '"1"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+    )
+    cache = process_cache(tmp_path, ttl=60)
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+
+    with open(cache.shared._path("https://test_identity_provider", "json")) as file:
+        entry = json.load(file)
+    assert time.time() < entry.pop("expires") <= time.time() + 60
+    assert entry == {
+        "jwks_uri": "https://test_identity_provider",
+        "keys": "first",
+        "etag": '"1"',
+        "last_modified": "Wed, 21 Oct 2015 07:28:00 GMT",
+    }
+
+
+def save_snapshot(directory, keys: str, expires: float, **entry):
+    layabauth.SharedKeys(str(directory)).save(
+        "https://test_identity_provider", dict(entry, keys=keys, expires=expires)
+    )
+
+
+def test_snapshot_is_used_if_keys_cannot_be_retrieved(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_exception(httpx.ConnectError("description"))
+    save_snapshot(tmp_path, "snapshot", time.time() - 10)
+    cache = process_cache(tmp_path, grace_period=60)
+
+    assert cache.load("https://test_identity_provider").text == "snapshot"
+    assert (
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache).text
+        == "snapshot"
+    )
+
+
+def test_snapshot_is_used_if_keys_cannot_be_retrieved_without_being_loaded(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_exception(httpx.ConnectError("description"))
+    save_snapshot(tmp_path, "snapshot", time.time() - 10)
+    cache = process_cache(tmp_path, grace_period=60)
+
+    assert (
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache).text
+        == "snapshot"
+    )
+
+
+def test_async_snapshot_is_used_if_keys_cannot_be_retrieved(httpx_mock, tmp_path):
+    httpx_mock.add_exception(httpx.ConnectError("description"))
+    save_snapshot(tmp_path, "snapshot", time.time() - 10)
+    cache = process_cache(tmp_path, grace_period=60)
+
+    async def retrieve_keys():
+        async with httpx.AsyncClient() as client:
+            return await layabauth._http.async_keys(
+                client, "https://test_identity_provider", cache
+            )
+
+    assert asyncio.run(retrieve_keys()).text == "snapshot"
+
+
+def test_snapshot_is_not_used_once_grace_period_is_over(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_exception(httpx.ConnectError("description"))
+    save_snapshot(tmp_path, "snapshot", time.time() - 10)
+    cache = process_cache(tmp_path, grace_period=5)
+
+    assert cache.load("https://test_identity_provider") is None
+    with pytest.raises(Exception) as exception_info:
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+    assert (
+        str(exception_info.value)
+        == "ConnectError error while retrieving keys: description"
+    )
+
+
+def test_snapshot_is_refreshed_using_conditional_request(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(
+        url="https://test_identity_provider",
+        match_headers={"If-None-Match": '"1"'},
+        status_code=304,
+    )
+    save_snapshot(tmp_path, "snapshot", time.time() - 10, etag='"1"')
+    cache = process_cache(tmp_path, grace_period=60)
+    cache.load("https://test_identity_provider")
+
+    assert (
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache).text
+        == "snapshot"
+    )
+
+
+def test_snapshot_older_than_current_keys_is_not_loaded(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    cache = process_cache(tmp_path, ttl=60)
+    layabauth._http.keys(httpx_client, "https://test_identity_provider", cache)
+    save_snapshot(tmp_path, "snapshot", time.time() + 10)
+
+    assert cache.load("https://test_identity_provider") is None
+    assert (
+        layabauth._http.keys(httpx_client, "https://test_identity_provider", cache).text
+        == "first"
+    )
+
+
+def test_snapshot_is_used_while_keys_are_being_retrieved(
+    httpx_mock, tmp_path, monkeypatch
+):
+    requested = threading.Event()
+    release = threading.Event()
+    request_keys = layabauth._http._request_keys
+
+    def slow_request(*args, **kwargs):
+        requested.set()
+        release.wait()
+        return request_keys(*args, **kwargs)
+
+    monkeypatch.setattr(layabauth._http, "_request_keys", slow_request)
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    save_snapshot(tmp_path, "snapshot", time.time() - 10)
+    cache = process_cache(tmp_path, grace_period=60)
+    cache.load("https://test_identity_provider")
+
+    with httpx.Client() as client, concurrent.futures.ThreadPoolExecutor() as pool:
+        retrieval = pool.submit(
+            layabauth._http.keys, client, "https://test_identity_provider", cache
+        )
+        requested.wait()
+        assert (
+            layabauth._http.keys(client, "https://test_identity_provider", cache).text
+            == "snapshot"
+        )
+        release.set()
+        assert retrieval.result().text == "first"
+
+
+CONFIGURATION_URI = "https://test_identity_provider/.well-known/openid-configuration"
+
+
+def test_discovery_document_retrieved_by_a_process_is_used_by_other_processes(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_response(
+        url=CONFIGURATION_URI, json={"jwks_uri": "https://test_identity_provider"}
+    )
+    httpx_mock.add_response(url="https://test_identity_provider", text="first")
+    first_process = process_cache(tmp_path)
+    second_process = process_cache(tmp_path)
+
+    first = layabauth._http.keys(httpx_client, CONFIGURATION_URI, first_process)
+    second = layabauth._http.keys(httpx_client, CONFIGURATION_URI, second_process)
+    assert first.text == second.text == "first"
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_discovered_snapshot_is_used_if_keys_cannot_be_retrieved(
+    httpx_client: httpx.Client, httpx_mock, tmp_path
+):
+    httpx_mock.add_exception(httpx.ConnectError("description"))
+    layabauth.SharedKeys(str(tmp_path)).save(
+        CONFIGURATION_URI,
+        {
+            "keys": json.dumps({"jwks_uri": "https://test_identity_provider"}),
+            "expires": time.time() - 10,
+        },
+    )
+    save_snapshot(tmp_path, "snapshot", time.time() - 10)
+    cache = process_cache(tmp_path, grace_period=60)
+
+    assert cache.load(CONFIGURATION_URI).text == "snapshot"
+    assert (
+        layabauth._http.keys(httpx_client, CONFIGURATION_URI, cache).text == "snapshot"
+    )
+
+
+def test_discovered_snapshot_is_not_loaded_without_discovery_document(tmp_path):
+    save_snapshot(tmp_path, "snapshot", time.time() - 10)
+    cache = process_cache(tmp_path, grace_period=60)
+
+    assert cache.load(CONFIGURATION_URI) is None
+
+
+def test_invalid_shared_discovery_document_is_ignored(tmp_path):
+    layabauth.SharedKeys(str(tmp_path)).save(
+        CONFIGURATION_URI, {"keys": "not json", "expires": time.time() + 60}
+    )
+    save_snapshot(tmp_path, "snapshot", time.time() + 60)
+
+    assert process_cache(tmp_path).load(CONFIGURATION_URI) is None
@@ -0,0 +1,92 @@
+import time
+
+import layabauth
+import layabauth._tokens
+
+JWKS_URI = "https://test_identity_provider"
+
+
+def test_token_body_is_cached_until_expiry():
+    cache = layabauth.TokenCache()
+    cache.put("token", JWKS_URI, {"upn": "TEST@email.com", "exp": time.time() + 3600})
+    assert cache.get("token", JWKS_URI)["upn"] == "TEST@email.com"
+    assert cache.get("other token", JWKS_URI) is None
+
+
+def test_cached_token_body_is_a_copy():
+    cache = layabauth.TokenCache()
+    cache.put("token", JWKS_URI, {"upn": "TEST@email.com", "exp": time.time() + 3600})
+    cache.get("token", JWKS_URI)["upn"] = "modified"
+    assert cache.get("token", JWKS_URI)["upn"] == "TEST@email.com"
+
+
+def test_expired_token_body_is_not_returned(monkeypatch):
+    cache = layabauth.TokenCache()
+    now = time.time()
+    cache.put("token", JWKS_URI, {"exp": now + 10})
+    monkeypatch.setattr(layabauth._tokens.time, "time", lambda: now + 10)
+    assert cache.get("token", JWKS_URI) is None
+    assert not cache._bodies
+
+
+def test_expired_token_body_is_not_cached():
+    cache = layabauth.TokenCache()
+    cache.put("token", JWKS_URI, {"exp": time.time() - 1})
+    assert cache.get("token", JWKS_URI) is None
+
+
+def test_token_body_without_expiry_is_not_cached():
+    cache = layabauth.TokenCache()
+    cache.put("token", JWKS_URI, {"exp": "invalid"})
+    cache.put("other token", JWKS_URI, {})
+    assert cache.get("token", JWKS_URI) is None
+    assert cache.get("other token", JWKS_URI) is None
+
+
+def test_token_body_is_cached_until_time_to_live_is_expired(monkeypatch):
+    cache = layabauth.TokenCache(ttl=5)
+    now = time.time()
+    monkeypatch.setattr(layabauth._tokens.time, "time", lambda: now)
+    cache.put("token", JWKS_URI, {"exp": now + 3600})
+    cache.put("token without expiry", JWKS_URI, {})
+    cache.put("token expiring soon", JWKS_URI, {"exp": now + 1})
+    assert cache._bodies[layabauth._tokens._digest("token", JWKS_URI)][0] == now + 5
+    monkeypatch.setattr(layabauth._tokens.time, "time", lambda: now + 2)
+    assert cache.get("token", JWKS_URI) == {"exp": now + 3600}
+    assert cache.get("token without expiry", JWKS_URI) == {}
+    assert cache.get("token expiring soon", JWKS_URI) is None
+    monkeypatch.setattr(layabauth._tokens.time, "time", lambda: now + 5)
+    assert cache.get("token", JWKS_URI) is None
+    assert cache.get("token without expiry", JWKS_URI) is None
+
+
+def test_least_recently_used_token_body_is_removed():
+    cache = layabauth.TokenCache(maxsize=2)
+    expiry = time.time() + 3600
+    cache.put("token1", JWKS_URI, {"exp": expiry})
+    cache.put("token2", JWKS_URI, {"exp": expiry})
+    assert cache.get("token1", JWKS_URI)
+    cache.put("token3", JWKS_URI, {"exp": expiry})
+    assert cache.get("token1", JWKS_URI)
+    assert cache.get("token2", JWKS_URI) is None
+    assert cache.get("token3", JWKS_URI)
+
+
+def test_raw_tokens_are_not_stored():
+    cache = layabauth.TokenCache()
+    cache.put("token", JWKS_URI, {"exp": time.time() + 3600})
+    assert list(cache._bodies) == [layabauth._tokens._digest("token", JWKS_URI)]
+
+
+def test_token_body_is_cached_per_jwks_uri():
+    cache = layabauth.TokenCache()
+    cache.put("token", JWKS_URI, {"upn": "TEST@email.com", "exp": time.time() + 3600})
+    assert cache.get("token", "https://other_identity_provider") is None
+    assert cache.get("token", JWKS_URI)["upn"] == "TEST@email.com"
+
+
+def test_cache_can_be_cleared():
+    cache = layabauth.TokenCache()
+    cache.put("token", JWKS_URI, {"exp": time.time() + 3600})
+    cache.clear()
+    assert cache.get("token", JWKS_URI) is None
@@ -0,0 +1,269 @@
+import base64
+import importlib.util
+import json
+import sys
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from jose import exceptions, jwk, jws, jwt
+
+import layabauth
+import layabauth._http
+import layabauth._verifier
+from tests.conftest import PRIVATE_KEYS
+
+verifiers = [layabauth.CryptographyVerifier(), layabauth.JoseVerifier()]
+
+
+def _segment(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).decode().rstrip("=")
+
+
+def _sign(payload: bytes, kid: str = "key1", algorithm: str = "RS256") -> str:
+    return jws.sign(
+        payload, PRIVATE_KEYS[kid], algorithm=algorithm, headers={"kid": kid}
+    )
+
+
+def _claims(claims: dict) -> str:
+    return _sign(json.dumps(claims).encode())
+
+
+@pytest.mark.parametrize("verifier", verifiers)
+def test_valid_token(verifier, jwks: dict, create_token):
+    keys = layabauth._http.KeySet(json.dumps(jwks), verifier)
+    token_body = {
+        "upn": "TEST@email.com",
+        "iat": int(time.time()),
+        "nbf": int(time.time()),
+        "exp": int(time.time()) + 3600,
+        "sub": "subject",
+        "jti": "identifier",
+        "aud": "not verified",
+    }
+    assert verifier.decode(create_token(token_body, kid="key2"), keys) == token_body
+
+
+@pytest.mark.parametrize(
+    "token, expected",
+    [
+        ("Fake token", "Not enough segments"),
+        ("a.b", "Not enough segments"),
+        ("a.e30.sig", "Not enough segments"),
+        (f"{_segment(b'not json')}.e30.sig", None),
+        (f"{_segment(b'[]')}.e30.sig", "Invalid header string: must be a json object"),
+        (f"{_segment(b'{}')}.a.sig", "Invalid payload padding"),
+        (f"{_segment(b'{}')}.e30.a", "Invalid crypto padding"),
+        (
+            f"{_segment(b'{}')}.e30.sig",
+            "No algorithm was specified in the JWS header.",
+        ),
+        (
+            jwt.encode({}, "secret", algorithm="HS256"),
+            "The specified alg value is not allowed",
+        ),
+        (
+            f"{_claims({})[:-4]}AAAA",
+            "Signature verification failed.",
+        ),
+        (
+            jws.sign(
+                b"{}", PRIVATE_KEYS["key1"], algorithm="RS256", headers={"kid": "key2"}
+            ),
+            "Signature verification failed.",
+        ),
+        (
+            jws.sign(
+                b"{}",
+                PRIVATE_KEYS["key1"],
+                algorithm="RS256",
+                headers={"kid": "unknown"},
+            ),
+            "Signature verification failed.",
+        ),
+        (_sign(b"not json"), None),
+        (_sign(b"[]"), "Invalid payload string: must be a json object"),
+        (_claims({"iat": "now"}), "Issued At claim (iat) must be an integer."),
+        (_claims({"nbf": "now"}), "Not Before claim (nbf) must be an integer."),
+        (_claims({"nbf": time.time() + 3600}), "The token is not yet valid (nbf)"),
+        (
+            _claims({"exp": "now"}),
+            "Expiration Time claim (exp) must be an integer.",
+        ),
+        (_claims({"exp": time.time() - 1}), "Signature has expired."),
+        (_claims({"iat": []}), "Issued At claim (iat) must be an integer."),
+        (_claims({"nbf": {}}), "Not Before claim (nbf) must be an integer."),
+        (
+            _claims({"iat": 0, "exp": None}),
+            "Expiration Time claim (exp) must be an integer.",
+        ),
+        (_claims({"sub": 1}), "Subject must be a string."),
+        (_claims({"jti": 1}), "JWT ID must be a string."),
+    ],
+)
+def test_invalid_token_is_reported_the_same_way(jwks: dict, token: str, expected: str):
+    errors = []
+    for verifier in verifiers:
+        keys = layabauth._http.KeySet(json.dumps(jwks), verifier)
+        with pytest.raises(exceptions.JWTError) as exception_info:
+            verifier.decode(token, keys)
+        errors.append((type(exception_info.value), str(exception_info.value)))
+
+    assert errors[0] == errors[1]
+    if expected:
+        assert errors[0][1] == expected
+
+
+@pytest.fixture
+def ec_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+@pytest.fixture
+def ec_jwks(jwks: dict, ec_key) -> dict:
+    pem = ec_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    public_key = jwk.construct(pem, "ES256").to_dict()
+    jwks["keys"].insert(0, dict(public_key, kid="ec"))
+    return jwks
+
+
+def _ec_token(ec_key, claims: dict, kid: str = "ec") -> str:
+    pem = ec_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return jwt.encode(claims, pem, algorithm="ES256", headers={"kid": kid})
+
+
+def test_elliptic_curve_signature(ec_jwks: dict, ec_key):
+    verifier = layabauth.CryptographyVerifier(algorithms=["RS256", "ES256"])
+    keys = layabauth._http.KeySet(json.dumps(ec_jwks), verifier)
+    assert verifier.decode(_ec_token(ec_key, {"upn": "TEST"}), keys) == {"upn": "TEST"}
+
+
+def test_elliptic_curve_signature_without_key_identifier(ec_jwks: dict, ec_key):
+    verifier = layabauth.CryptographyVerifier(algorithms=["RS256", "ES256"])
+    keys = layabauth._http.KeySet(json.dumps(ec_jwks), verifier)
+    pem = ec_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    token = jwt.encode({"upn": "TEST"}, pem, algorithm="ES256")
+    assert verifier.decode(token, keys) == {"upn": "TEST"}
+
+
+def test_rsa_signature_without_key_identifier(ec_jwks: dict):
+    verifier = layabauth.CryptographyVerifier()
+    keys = layabauth._http.KeySet(json.dumps(ec_jwks), verifier)
+    token = jwt.encode({"upn": "TEST"}, PRIVATE_KEYS["key2"], algorithm="RS256")
+    assert verifier.decode(token, keys) == {"upn": "TEST"}
+
+
+def test_elliptic_curve_signature_with_invalid_size(ec_jwks: dict, ec_key):
+    verifier = layabauth.CryptographyVerifier(algorithms=["ES256"])
+    keys = layabauth._http.KeySet(json.dumps(ec_jwks), verifier)
+    token = _ec_token(ec_key, {"upn": "TEST"})
+    with pytest.raises(exceptions.JWTError) as exception_info:
+        verifier.decode(f"{token}AAAA", keys)
+    assert str(exception_info.value) == "Signature verification failed."
+
+
+def test_elliptic_curve_signature_with_rsa_key(ec_jwks: dict, ec_key):
+    verifier = layabauth.CryptographyVerifier(algorithms=["ES256"])
+    keys = layabauth._http.KeySet(json.dumps(ec_jwks), verifier)
+    with pytest.raises(exceptions.JWTError) as exception_info:
+        verifier.decode(_ec_token(ec_key, {"upn": "TEST"}, kid="key1"), keys)
+    assert str(exception_info.value) == "Signature verification failed."
+
+
+def test_unsupported_key_type():
+    with pytest.raises(exceptions.JWKError) as exception_info:
+        layabauth.CryptographyVerifier().construct({"kty": "oct", "k": "secret"})
+    assert str(exception_info.value) == "Unsupported key type: oct"
+
+
+def test_unsupported_algorithms():
+    with pytest.raises(ValueError) as exception_info:
+        layabauth.CryptographyVerifier(algorithms=["RS256", "HS256", "none"])
+    assert str(exception_info.value) == "Unsupported algorithms: HS256, none"
+
+
+def test_verifiers_equality():
+    assert layabauth.CryptographyVerifier() == layabauth.CryptographyVerifier()
+    assert layabauth.CryptographyVerifier() != layabauth.JoseVerifier()
+    assert layabauth.CryptographyVerifier() != layabauth.CryptographyVerifier(
+        algorithms=["ES256"]
+    )
+    assert len({layabauth.JoseVerifier(), layabauth.JoseVerifier()}) == 1
+
+
+def test_verifier_interface():
+    with pytest.raises(TypeError):
+        layabauth.Verifier()
+
+    class IncompleteVerifier(layabauth.Verifier):
+        def construct(self, key: dict):
+            return key
+
+    with pytest.raises(TypeError):
+        IncompleteVerifier()
+
+
+def test_custom_verifier(jwks: dict, create_token):
+    class CustomVerifier(layabauth.Verifier):
+        def __init__(self, audience: str):
+            super().__init__()
+            self.audience = audience
+
+        def __eq__(self, other) -> bool:
+            return super().__eq__(other) and self.audience == other.audience
+
+        def __hash__(self) -> int:
+            return hash((super().__hash__(), self.audience))
+
+        def construct(self, key: dict):
+            return layabauth.JoseVerifier().construct(key)
+
+        def decode(self, token: str, keys) -> dict:
+            claims = layabauth.JoseVerifier().decode(token, keys)
+            if claims.get("aud") != self.audience:
+                raise exceptions.JWTClaimsError("Invalid audience")
+            return claims
+
+    first, second = CustomVerifier("first"), CustomVerifier("second")
+    assert first == CustomVerifier("first")
+    assert first != second
+    token = create_token({"aud": "first"})
+    keys = layabauth._http.KeySet(json.dumps(jwks), first)
+    assert layabauth._http.validate(token, keys) == {"aud": "first"}
+    keys = layabauth._http.KeySet(json.dumps(jwks), second)
+    with pytest.raises(exceptions.JWTClaimsError):
+        layabauth._http.validate(token, keys)
+
+
+def test_default_verifier():
+    assert isinstance(layabauth._verifier.default(), layabauth.CryptographyVerifier)
+    assert isinstance(layabauth.KeysCache().verifier, layabauth.CryptographyVerifier)
+
+
+def test_cryptography_is_optional(monkeypatch):
+    monkeypatch.setitem(sys.modules, "cryptography", None)
+    spec = importlib.util.spec_from_file_location(
+        "verifier_without_cryptography", layabauth._verifier.__file__
+    )
+    verifier = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(verifier)
+
+    assert isinstance(verifier.default(), verifier.JoseVerifier)
+    with pytest.raises(ImportError) as exception_info:
+        verifier.CryptographyVerifier()
+    assert (
+        str(exception_info.value)
+        == "cryptography must be installed: python -m pip install layabauth[cryptography]"
+    )